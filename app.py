@@ -7,6 +7,7 @@ Execute com: streamlit run app.py
 import streamlit as st
 import os
 import sys
+import time
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent))
@@ -66,23 +67,55 @@ API-429: Rate limit excedido"""
 
 
 def init_state():
-    if "rag" not in st.session_state:
-        st.session_state.rag = None
-    if "loaded" not in st.session_state:
-        st.session_state.loaded = False
     if "history" not in st.session_state:
         st.session_state.history = []
 
 
+@st.cache_resource(show_spinner=False)
+def load_rag():
+    """Pipeline único do processo, carregado do índice persistido."""
+    from src.rag.pipeline import get_shared_pipeline
+    return get_shared_pipeline()
+
+
 def get_rag():
-    if st.session_state.rag is None:
-        try:
-            from src.rag.pipeline import RAGPipeline
-            st.session_state.rag = RAGPipeline()
-        except Exception as e:
-            st.error(f"Erro: {e}")
-            return None
-    return st.session_state.rag
+    try:
+        return load_rag()
+    except Exception as e:
+        st.error(f"Erro: {e}")
+        return None
+
+
+@st.cache_resource(show_spinner=False)
+def get_indexer():
+    """Fila de indexação em background, compartilhada entre as sessões."""
+    from src.api.ingest import IngestManager
+    return {"manager": IngestManager(batch_size=1), "job_id": None}
+
+
+def start_indexing(documents):
+    """Indexa em background; várias sessões não disparam jobs duplicados."""
+    import io
+    import json
+    from src.api.ingest import spool_upload
+    
+    indexer = get_indexer()
+    job = indexer["job_id"] and indexer["manager"].get(indexer["job_id"])
+    if job and job.state in ("queued", "running"):
+        return
+    body = "\n".join(json.dumps(doc, ensure_ascii=False) for doc in documents).encode("utf-8")
+    source = spool_upload(io.BytesIO(body), "exemplos.ndjson")
+    indexer["job_id"] = indexer["manager"].submit(get_rag(), [source]).job_id
+
+
+def indexing_status():
+    indexer = get_indexer()
+    return indexer["manager"].get(indexer["job_id"]) if indexer["job_id"] else None
+
+
+def is_loaded() -> bool:
+    rag = get_rag()
+    return bool(rag and rag.documents)
 
 
 def render_sidebar():
@@ -101,22 +134,24 @@ def render_sidebar():
         # Documentos
         st.markdown("### 📄 Documentos")
         
-        if not st.session_state.loaded:
-            if st.button("📥 Carregar Exemplos"):
-                rag = get_rag()
-                if rag:
-                    with st.spinner("Indexando..."):
-                        rag.add_documents(EXAMPLE_DOCS)
-                    st.session_state.loaded = True
-                    st.success("✅ Carregado!")
-                    st.rerun()
-        else:
+        job = indexing_status()
+        if job and job.state in ("queued", "running"):
+            st.progress(job.progress, text=f"Indexando... {job.documents} docs")
+            time.sleep(0.5)
+            st.rerun()
+        elif is_loaded():
             st.success("✅ Documentos prontos")
+        elif st.button("📥 Carregar Exemplos"):
+            start_indexing(EXAMPLE_DOCS)
+            st.rerun()
+        
+        if job and job.state == "failed":
+            st.error(f"Indexação falhou: {job.error_samples[-1:]}")
         
         st.markdown("---")
         
         # Stats
-        if st.session_state.loaded:
+        if is_loaded():
             rag = get_rag()
             if rag:
                 stats = rag.get_stats()
@@ -129,7 +164,7 @@ def render_main():
     st.markdown('<p class="main-header">🏢 RAG Enterprise</p>', unsafe_allow_html=True)
     st.markdown('<p style="text-align:center;color:#60a5fa;">Sistema RAG Completo para Produção</p>', unsafe_allow_html=True)
     
-    if not st.session_state.loaded:
+    if not is_loaded():
         st.info("👈 Carregue os documentos de exemplo para começar")
         
         # Features
@@ -176,23 +211,31 @@ def render_main():
         if query:
             rag = get_rag()
             if rag:
-                with st.spinner("🔄 Processando..."):
-                    result = rag.process(query)
-                
                 st.markdown("---")
+                metrics = st.container()
                 
-                # Métricas
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Confiança", f"{result.confidence*100:.0f}%")
-                with col2:
-                    st.metric("Latência", f"{result.latency_ms:.0f}ms")
-                with col3:
-                    st.metric("Refinado", "Sim" if result.was_refined else "Não")
-                
-                # Resposta
+                # Resposta (tokens chegam em streaming)
                 st.markdown("### 💡 Resposta")
-                st.write(result.answer)
+                placeholder = st.empty()
+                streamed = []
+                
+                def on_token(token):
+                    streamed.append(token)
+                    placeholder.markdown("".join(streamed) + "▌")
+                
+                with st.spinner("🔄 Processando..."):
+                    result = rag.process(query, on_token=on_token)
+                placeholder.markdown(result.answer)
+                
+                # Métricas
+                with metrics:
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        st.metric("Confiança", f"{result.confidence*100:.0f}%")
+                    with col2:
+                        st.metric("Latência", f"{result.latency_ms:.0f}ms")
+                    with col3:
+                        st.metric("Refinado", "Sim" if result.was_refined else "Não")
                 
                 # Fontes
                 if result.sources:
@@ -3,13 +3,18 @@ orchestrator.py
 Orquestrador de agentes do RAG Enterprise.
 """
 
+import asyncio
+import contextvars
+import time
+from functools import lru_cache
 from typing import TypedDict, List, Optional
-from langgraph.graph import StateGraph, END, START
 import logging
 
 from src.config import settings
-from src.models import SearchResult, QueryResponse
-from src.rag.pipeline import RAGPipeline
+from src.models import SearchResult, QueryResponse, RouteDecision, EvaluationResult
+from src.observability.metrics import get_metrics
+from src.observability.trace import request_trace, trace_count, trace_stage
+from src.rag.pipeline import RAGPipeline, get_shared_pipeline
 
 logger = logging.getLogger(__name__)
 
@@ -18,106 +23,281 @@ class AgentState(TypedDict):
     """Estado compartilhado entre agentes."""
     query: str
     strategy: str
+    identifiers: List[str]
     context: List[dict]
     answer: str
     confidence: float
+    skip_validation: bool
+    evaluation: dict
     needs_refinement: bool
+    fingerprints: List[str]
     iteration: int
+    refined: bool
     final_answer: str
 
 
-class Orchestrator:
-    """Orquestra os agentes do sistema."""
-    
-    def __init__(self):
-        self.pipeline = RAGPipeline()
-        self.graph = self._build_graph()
-    
-    def _build_graph(self) -> StateGraph:
-        """Constrói grafo de agentes."""
-        workflow = StateGraph(AgentState)
-        
-        # Nós (agentes)
-        workflow.add_node("classifier", self._classify)
-        workflow.add_node("retriever", self._retrieve)
-        workflow.add_node("generator", self._generate)
-        workflow.add_node("validator", self._validate)
-        workflow.add_node("refiner", self._refine)
-        workflow.add_node("output", self._output)
-        
-        # Fluxo
-        workflow.add_edge(START, "classifier")
-        workflow.add_edge("classifier", "retriever")
-        workflow.add_edge("retriever", "generator")
-        workflow.add_edge("generator", "validator")
-        
+def _node(name: str):
+    """Nó do grafo que delega ao Orchestrator passado em config.
+
+    O grafo compilado não guarda referência a nenhuma instância, por isso
+    pode ser compartilhado no processo. No caminho async usa o método
+    `_a<nome>` quando existe; senão roda o método síncrono em executor,
+    no mesmo contexto (trace e deadline da requisição).
+    """
+    from langchain_core.runnables import RunnableLambda
+
+    stage = "node:" + name.lstrip("_")
+
+    def run(state: AgentState, config) -> dict:
+        with trace_stage(stage):
+            return getattr(config["configurable"]["orchestrator"], name)(state)
+
+    async def arun(state: AgentState, config) -> dict:
+        orchestrator = config["configurable"]["orchestrator"]
+        amethod = getattr(orchestrator, "_a" + name.lstrip("_"), None)
+        with trace_stage(stage):
+            if amethod is not None:
+                return await amethod(state)
+            loop = asyncio.get_running_loop()
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(None, context.run, getattr(orchestrator, name), state)
+
+    return RunnableLambda(run, afunc=arun, name=name.lstrip("_"))
+
+
+def _should_refine(state: AgentState) -> str:
+    refinements = state["iteration"] - 1
+    if state["needs_refinement"] and refinements < settings.max_refinements:
+        return "refiner"
+    return "output"
+
+
+@lru_cache(maxsize=1)
+def _compiled_graph():
+    """Compila o grafo de agentes uma vez por processo."""
+    from langgraph.graph import StateGraph, END, START
+
+    workflow = StateGraph(AgentState)
+
+    # Nós (agentes)
+    workflow.add_node("classifier", _node("_classify"))
+    workflow.add_node("retriever", _node("_retrieve"))
+    workflow.add_node("generator", _node("_generate"))
+    workflow.add_node("validator", _node("_validate"))
+    workflow.add_node("refiner", _node("_refine"))
+    workflow.add_node("output", _node("_output"))
+
+    # Fluxo
+    workflow.add_edge(START, "classifier")
+    workflow.add_conditional_edges(
+        "classifier",
+        lambda s: "output" if s["strategy"] == "cache" else "retriever",
+        {"retriever": "retriever", "output": "output"}
+    )
+    workflow.add_edge("retriever", "generator")
+    workflow.add_conditional_edges(
+        "generator",
+        lambda s: "output" if s["skip_validation"] else "validator",
+        {"validator": "validator", "output": "output"}
+    )
+
+    # O refinador faz a tentativa completa (busca, geração e avaliação)
+    # e se repete enquanto houver trabalho novo e tentativas restantes
+    for node in ("validator", "refiner"):
         workflow.add_conditional_edges(
-            "validator",
-            lambda s: "refiner" if s["needs_refinement"] and s["iteration"] < 2 else "output",
+            node,
+            _should_refine,
             {"refiner": "refiner", "output": "output"}
         )
-        
-        workflow.add_edge("refiner", "generator")
-        workflow.add_edge("output", END)
-        
-        return workflow.compile()
-    
+
+    workflow.add_edge("output", END)
+
+    return workflow.compile()
+
+
+class Orchestrator:
+    """Orquestra os agentes do sistema.
+
+    Por padrão usa o pipeline compartilhado do processo (mesmo índice e
+    clientes da API); um pipeline existente pode ser passado explicitamente.
+    """
+
+    def __init__(self, pipeline: Optional[RAGPipeline] = None):
+        self._pipeline = pipeline
+
+    @property
+    def pipeline(self) -> RAGPipeline:
+        if self._pipeline is None:
+            self._pipeline = get_shared_pipeline()
+        return self._pipeline
+
+    @property
+    def graph(self):
+        """Grafo compilado (compartilhado no processo)."""
+        return _compiled_graph()
+
+    def _config(self, **kwargs) -> dict:
+        return {"configurable": {"orchestrator": self}, **kwargs}
+
     def _classify(self, state: AgentState) -> dict:
-        """Classifica a query."""
-        # Simplificado - sempre usa hybrid
-        return {"strategy": "hybrid"}
-    
+        """Classifica a query (roteador local, sem LLM)."""
+        decision = self.pipeline.router.route(state["query"], state["strategy"] or "auto")
+        if decision.strategy == "cache":
+            cached = self.pipeline.answer_cache.get(state["query"])
+            trace_count("answer_cache_hit" if cached is not None else "answer_cache_miss")
+            if cached is not None:
+                return {"strategy": "cache", "answer": cached.answer, "confidence": cached.confidence}
+            decision.strategy = "hybrid"
+        return {"strategy": decision.strategy, "identifiers": decision.identifiers}
+
     def _retrieve(self, state: AgentState) -> dict:
         """Busca documentos."""
-        results = self.pipeline.hybrid_search(state["query"])
-        context = [{"content": r.content, "score": r.score} for r in results]
-        return {"context": context}
-    
+        results = self.pipeline.retrieve(state["query"], strategy=state["strategy"])
+        update = {"context": [r.model_dump() for r in results]}
+
+        # Match exato de identificador dispensa o validador
+        decision = RouteDecision(strategy=state["strategy"], identifiers=state["identifiers"])
+        if self.pipeline.router.is_exact_match(decision, results):
+            update.update(skip_validation=True, confidence=1.0)
+            trace_count("validation_skipped")
+            if settings.enable_metrics:
+                get_metrics().record_skip("validation")
+        return update
+
     def _generate(self, state: AgentState) -> dict:
         """Gera resposta."""
         results = [SearchResult(**c) for c in state["context"]]
         answer = self.pipeline.generate(state["query"], results)
         return {"answer": answer, "iteration": state.get("iteration", 0) + 1}
-    
+
+    async def _agenerate(self, state: AgentState) -> dict:
+        results = [SearchResult(**c) for c in state["context"]]
+        answer = await self.pipeline.agenerate(state["query"], results)
+        return {"answer": answer, "iteration": state.get("iteration", 0) + 1}
+
     def _validate(self, state: AgentState) -> dict:
         """Valida resposta."""
         results = [SearchResult(**c) for c in state["context"]]
         evaluation = self.pipeline.evaluate(state["answer"], results)
         return {
             "confidence": evaluation.utility_score / 5,
+            "evaluation": evaluation.model_dump(),
+            "needs_refinement": evaluation.needs_refinement
+        }
+
+    async def _avalidate(self, state: AgentState) -> dict:
+        results = [SearchResult(**c) for c in state["context"]]
+        evaluation = await self.pipeline.aevaluate(state["answer"], results)
+        return {
+            "confidence": evaluation.utility_score / 5,
+            "evaluation": evaluation.model_dump(),
             "needs_refinement": evaluation.needs_refinement
         }
-    
+
     def _refine(self, state: AgentState) -> dict:
-        """Prepara para refinamento."""
-        return {}
-    
+        """Refina com contexto novo; para se o prompt não mudaria."""
+        results = [SearchResult(**c) for c in state["context"]]
+        seen = set(state["fingerprints"])
+        refinement = self.pipeline.refine(
+            state["query"],
+            results,
+            EvaluationResult(**state["evaluation"]),
+            attempt=state["iteration"],
+            strategy=state["strategy"],
+            seen=seen
+        )
+        if refinement is None:
+            return {"needs_refinement": False}
+
+        update = {"iteration": state["iteration"] + 1, "fingerprints": sorted(seen)}
+        if refinement.improved:
+            update.update(
+                answer=refinement.answer,
+                context=[r.model_dump() for r in refinement.context],
+                confidence=refinement.evaluation.utility_score / 5,
+                evaluation=refinement.evaluation.model_dump(),
+                needs_refinement=refinement.evaluation.needs_refinement,
+                refined=True
+            )
+        return update
+
     def _output(self, state: AgentState) -> dict:
         """Prepara output final."""
+        if state["strategy"] != "cache" and state["confidence"] >= settings.answer_cache_min_confidence:
+            self.pipeline.answer_cache.put(
+                state["query"],
+                QueryResponse(answer=state["answer"], confidence=state["confidence"], strategy_used=state["strategy"])
+            )
         return {"final_answer": state["answer"]}
-    
+
     def add_documents(self, documents: List[str]):
         """Adiciona documentos."""
         self.pipeline.add_documents(documents)
-    
-    def process(self, question: str) -> QueryResponse:
-        """Processa pergunta."""
-        initial: AgentState = {
+
+    @staticmethod
+    def _initial_state(question: str, strategy: str = "auto") -> AgentState:
+        return {
             "query": question,
-            "strategy": "",
+            "strategy": strategy,
+            "identifiers": [],
             "context": [],
             "answer": "",
             "confidence": 0.0,
+            "skip_validation": False,
+            "evaluation": {},
             "needs_refinement": False,
+            "fingerprints": [],
             "iteration": 0,
+            "refined": False,
             "final_answer": ""
         }
-        
-        result = self.graph.invoke(initial)
-        
-        return QueryResponse(
+
+    @staticmethod
+    def _to_response(result: dict, start: float = None) -> QueryResponse:
+        response = QueryResponse(
             answer=result["final_answer"],
             confidence=result["confidence"],
             strategy_used=result["strategy"],
-            was_refined=result["iteration"] > 1
+            was_refined=result["refined"],
+            # Inclui as fontes colapsadas como quase-duplicatas no chunk
+            sources=list(dict.fromkeys(
+                source for c in result["context"][:3] for source in c["metadata"].get("sources", [c["source"]])
+            ))
+        )
+        if start is not None:
+            response.latency_ms = (time.time() - start) * 1000
+            if settings.enable_metrics:
+                get_metrics().record_route_latency(response.strategy_used, response.latency_ms / 1000)
+        return response
+
+    def process(self, question: str, strategy: str = "auto") -> QueryResponse:
+        """Processa pergunta."""
+        start = time.time()
+        with request_trace("orchestrator") as trace:
+            trace.set(question=question[:200])
+            result = self.graph.invoke(self._initial_state(question, strategy), config=self._config())
+        return self._to_response(result, start)
+
+    async def aprocess(self, question: str, strategy: str = "auto") -> QueryResponse:
+        """Processa pergunta (async)."""
+        start = time.time()
+        with request_trace("orchestrator") as trace:
+            trace.set(question=question[:200])
+            result = await self.graph.ainvoke(self._initial_state(question, strategy), config=self._config())
+        return self._to_response(result, start)
+
+    def batch(self, questions: List[str], max_concurrency: int = None) -> List[QueryResponse]:
+        """Processa várias perguntas com o mesmo pipeline."""
+        results = self.graph.batch(
+            [self._initial_state(q) for q in questions],
+            config=self._config(max_concurrency=max_concurrency)
+        )
+        return [self._to_response(r) for r in results]
+
+    async def abatch(self, questions: List[str], max_concurrency: int = None) -> List[QueryResponse]:
+        """Processa várias perguntas no mesmo event loop."""
+        results = await self.graph.abatch(
+            [self._initial_state(q) for q in questions],
+            config=self._config(max_concurrency=max_concurrency)
         )
+        return [self._to_response(r) for r in results]
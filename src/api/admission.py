@@ -0,0 +1,218 @@
+"""
+admission.py
+Controle de admissão da API: rate limiting por API key, fila com
+prioridade e limite de concorrência adaptativo (AIMD sobre a latência).
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Dict, Tuple
+
+from src.config import settings
+from src.observability.metrics import get_metrics
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+
+class Overloaded(Exception):
+    """Requisição rejeitada pelo controle de admissão."""
+
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+class TokenBucket:
+    """Token bucket: `rate` tokens/s, até `capacity` acumulados."""
+
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def try_acquire(self) -> Tuple[bool, float]:
+        """Consome um token. Retorna (ok, segundos até o próximo token)."""
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0.0
+        return False, (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Um token bucket por API key (settings.rate_limit req/min)."""
+
+    def __init__(self, per_minute: int = None, burst: int = None, max_keys: int = 10000):
+        self.rate = (per_minute or settings.rate_limit) / 60
+        self.burst = burst or settings.rate_limit_burst
+        self.max_keys = max_keys
+        self.buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def check(self, key: str):
+        """Levanta Overloaded(429) se a chave excedeu o limite."""
+        with self._lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_keys:
+                    self.buckets.clear()
+                bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+            ok, retry_after = bucket.try_acquire()
+        if not ok:
+            raise Overloaded(429, "rate_limited", retry_after)
+
+
+class AdmissionController:
+    """Fila limitada com prioridade e limite de concorrência adaptativo.
+
+    A cada `sample` requisições que chegaram ao upstream, a mediana delas
+    é comparada com a linha de base (mediana das últimas `window`): até
+    `tolerance` x a base o limite cresce aditivamente, acima disso cai
+    multiplicativamente. Decidir por amostra, não por requisição, evita que
+    a variação normal da latência do LLM encolha o limite sem sobrecarga.
+    Falhas do upstream reduzem o limite na hora. Cache hits e erros 4xx
+    não entram nas amostras nem ajustam o limite. Requisições acima do
+    limite esperam na fila (maior prioridade primeiro) até `max_wait`;
+    com a fila cheia são rejeitadas na hora.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = None,
+        min_limit: int = None,
+        max_limit: int = None,
+        queue_size: int = None,
+        max_wait: float = None,
+        tolerance: float = None,
+        window: int = None,
+        sample: int = None
+    ):
+        self.limit = float(initial_limit or settings.admission_initial_concurrency)
+        self.min_limit = min_limit or settings.admission_min_concurrency
+        self.max_limit = max_limit or settings.admission_max_concurrency
+        self.queue_size = queue_size if queue_size is not None else settings.admission_queue_size
+        self.max_wait = max_wait if max_wait is not None else settings.admission_max_wait
+        self.tolerance = tolerance or settings.admission_latency_tolerance
+
+        self.in_flight = 0
+        self.latencies = deque(maxlen=window or settings.admission_latency_window)
+        self.sample = sample or settings.admission_latency_sample
+        self._sampled = 0  # latências desde a última decisão
+        self.avg_latency = 0.0
+        self._queue = []
+        self._seq = itertools.count()
+
+    async def acquire(self, priority: str = "normal"):
+        """Aguarda uma vaga ou levanta Overloaded(503)."""
+        if self.in_flight < int(self.limit) and not self._queue:
+            self.in_flight += 1
+            self._report()
+            return
+
+        if len(self._queue) >= self.queue_size:
+            self._reject("queue_full")
+            raise Overloaded(503, "queue_full", self._retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        entry = [PRIORITIES.get(priority, 1), next(self._seq), waiter]
+        heapq.heappush(self._queue, entry)
+        self._report()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            self._abandon(entry)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._reject("queue_timeout")
+            raise Overloaded(503, "queue_timeout", self._retry_after())
+
+    def _abandon(self, entry: list):
+        """Remove um waiter que desistiu (timeout ou cliente desconectou)."""
+        waiter = entry[2]
+        if waiter.done():
+            # A vaga chegou junto com a desistência: devolve
+            self.in_flight -= 1
+            self._dispatch()
+            return
+        waiter.cancel()
+        self._queue.remove(entry)
+        heapq.heapify(self._queue)
+        self._report()
+
+    @property
+    def baseline(self) -> float:
+        """Latência de referência: mediana da janela longa."""
+        return statistics.median(self.latencies) if self.latencies else math.inf
+
+    def release(self, latency: float, error: bool = False, upstream: bool = True):
+        """Libera a vaga e registra a latência observada.
+
+        upstream=False (cache hit, 4xx) só devolve a vaga.
+        """
+        self.in_flight -= 1
+        if upstream or error:
+            self.avg_latency = latency if not self.avg_latency else 0.9 * self.avg_latency + 0.1 * latency
+        if error:
+            self.limit = max(self.min_limit, self.limit * 0.9)
+        elif upstream:
+            self.latencies.append(latency)
+            self._sampled += 1
+            if self._sampled >= self.sample:
+                self._adjust()
+
+        self._dispatch()
+
+    def _adjust(self):
+        """Ajusta o limite pela mediana da amostra recente contra a linha de base."""
+        recent = list(itertools.islice(reversed(self.latencies), self._sampled))
+        if statistics.median(recent) > self.baseline * self.tolerance:
+            self.limit = max(self.min_limit, self.limit * 0.9)
+        else:
+            self.limit = min(self.max_limit, self.limit + self._sampled / self.limit)
+        self._sampled = 0
+
+    def _dispatch(self):
+        while self._queue and self.in_flight < int(self.limit):
+            _, _, waiter = heapq.heappop(self._queue)
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(True)
+        self._report()
+
+    def _retry_after(self) -> float:
+        if not self.avg_latency:
+            return 1.0
+        return self.avg_latency * (len(self._queue) + 1) / max(1, int(self.limit))
+
+    def _reject(self, reason: str):
+        if settings.enable_metrics:
+            get_metrics().record_rejection(reason)
+
+    def _report(self):
+        if settings.enable_metrics:
+            get_metrics().set_admission(self.limit, self.in_flight, len(self._queue))
+
+    def get_stats(self) -> dict:
+        return {
+            "concurrency_limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queued": len(self._queue),
+            "avg_latency_ms": self.avg_latency * 1000
+        }
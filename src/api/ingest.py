@@ -0,0 +1,229 @@
+"""
+ingest.py
+Ingestão em lote: upload NDJSON/multipart gravado em disco e indexado em
+background, com progresso consultável por job id.
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from src.config import settings
+from src.models import IngestStatus
+
+logger = logging.getLogger(__name__)
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/json-lines")
+NDJSON_SUFFIXES = (".ndjson", ".jsonl")
+MAX_ERROR_SAMPLES = 20
+SKIP_BLOCK = 1024 * 1024
+
+# (caminho do arquivo em disco, formato: "ndjson" ou "text")
+Source = Tuple[str, str]
+
+
+def _spool_file() -> BinaryIO:
+    return tempfile.NamedTemporaryFile(prefix="rag-ingest-", delete=False)
+
+
+async def spool_stream(chunks) -> Source:
+    """Grava um corpo NDJSON recebido em streaming num arquivo temporário."""
+    from fastapi.concurrency import run_in_threadpool
+
+    f = _spool_file()
+    try:
+        async for chunk in chunks:
+            await run_in_threadpool(f.write, chunk)
+    finally:
+        f.close()
+    return f.name, "ndjson"
+
+
+def spool_upload(fileobj: BinaryIO, filename: str = "") -> Source:
+    """Copia um arquivo de upload multipart para um arquivo temporário."""
+    with _spool_file() as f:
+        shutil.copyfileobj(fileobj, f, 1024 * 1024)
+    kind = "ndjson" if (filename or "").lower().endswith(NDJSON_SUFFIXES) else "text"
+    return f.name, kind
+
+
+def parse_line(line: bytes) -> str:
+    """Documento de uma linha NDJSON: string ou objeto com `content`/`text`."""
+    value = json.loads(line)
+    if isinstance(value, dict):
+        value = value.get("content", value.get("text"))
+    if not isinstance(value, str):
+        raise ValueError("linha sem campo de texto")
+    return value
+
+
+class IngestManager:
+    """Executa jobs de ingestão um por vez, em lotes de `batch_size`.
+
+    Os lotes são indexados com append e o índice é persistido uma vez no
+    fim do job. O estado é gravado em `index_dir/jobs` para que qualquer
+    worker da API consiga responder pelo status.
+    """
+
+    def __init__(self, batch_size: int = None, status_dir: str = None, max_jobs: int = None):
+        self.batch_size = batch_size or settings.ingest_batch_size
+        self.status_dir = Path(status_dir or Path(settings.index_dir) / "jobs")
+        self.max_jobs = max_jobs or settings.ingest_max_jobs
+        self.jobs: "OrderedDict[str, IngestStatus]" = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+        self._lock = threading.Lock()
+
+    def submit(self, pipeline, sources: List[Source]) -> IngestStatus:
+        """Enfileira o job e retorna seu estado inicial."""
+        status = IngestStatus(
+            job_id=uuid.uuid4().hex,
+            bytes_total=sum(os.path.getsize(path) for path, _ in sources),
+            created_at=time.time()
+        )
+        with self._lock:
+            self.jobs[status.job_id] = status
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+        self._save(status)
+        self._executor.submit(self._run, pipeline, status, sources)
+        return status
+
+    def get(self, job_id: str) -> Optional[IngestStatus]:
+        """Estado do job (memória local ou arquivo gravado por outro worker)."""
+        with self._lock:
+            status = self.jobs.get(job_id)
+        if status is not None:
+            return status.model_copy()
+        path = self.status_dir / f"{job_id}.json"
+        if job_id.isalnum() and path.exists():
+            return IngestStatus.model_validate_json(path.read_text(encoding="utf-8"))
+        return None
+
+    def _run(self, pipeline, status: IngestStatus, sources: List[Source]):
+        status.state = "running"
+        status.started_at = time.time()
+        self._save(status)
+
+        batch = []
+        try:
+            for document in self._documents(status, sources):
+                batch.append(document)
+                if len(batch) >= self.batch_size:
+                    self._index(pipeline, status, batch)
+                    batch = []
+            if batch:
+                self._index(pipeline, status, batch)
+            if status.documents:
+                pipeline.commit_index()
+            status.state = "done"
+        except Exception as e:
+            logger.exception(f"Job de ingestão {status.job_id} falhou")
+            self._error(status, repr(e))
+            status.state = "failed"
+        finally:
+            for path, _ in sources:
+                Path(path).unlink(missing_ok=True)
+            status.finished_at = time.time()
+            self._update(status)
+            logger.info(
+                f"Ingestão {status.job_id}: {status.state}, {status.documents} docs, "
+                f"{status.errors} erros, {status.docs_per_second:.1f} docs/s"
+            )
+
+    def _documents(self, status: IngestStatus, sources: List[Source]) -> Iterator[str]:
+        """Lê os arquivos incrementalmente; linhas inválidas contam como erro.
+
+        Documentos acima de ingest_max_document_bytes (arquivo de texto ou
+        linha NDJSON) são pulados sem serem carregados na memória.
+        """
+        limit = settings.ingest_max_document_bytes
+        for path, kind in sources:
+            with open(path, "rb") as f:
+                if kind == "text":
+                    size = os.fstat(f.fileno()).st_size
+                    status.bytes_read += size
+                    if size > limit:
+                        self._error(status, f"arquivo de texto com {size} bytes excede o limite de {limit}")
+                        continue
+                    text = f.read().decode("utf-8", errors="replace").strip()
+                    if text:
+                        yield text
+                    continue
+
+                number = 0
+                while True:
+                    line = f.readline(limit + 1)
+                    if not line:
+                        break
+                    number += 1
+                    status.bytes_read += len(line)
+                    if len(line) > limit and not line.endswith(b"\n"):
+                        status.bytes_read += self._skip_line(f)
+                        self._error(status, f"linha {number}: excede o limite de {limit} bytes")
+                        continue
+                    if not line.strip():
+                        continue
+                    try:
+                        yield parse_line(line)
+                    except ValueError as e:
+                        self._error(status, f"linha {number}: {e}")
+
+    @staticmethod
+    def _skip_line(f: BinaryIO) -> int:
+        """Descarta o resto da linha atual em blocos; retorna os bytes lidos."""
+        skipped = 0
+        while True:
+            block = f.readline(SKIP_BLOCK)
+            skipped += len(block)
+            if not block or block.endswith(b"\n"):
+                return skipped
+
+    def _index(self, pipeline, status: IngestStatus, batch: List[str]):
+        try:
+            report = pipeline.add_documents(batch, append=True, commit=False)
+        except Exception as e:
+            logger.warning(f"Lote de ingestão falhou: {e!r}")
+            self._error(status, f"lote {status.batches + 1}: {e!r}", count=len(batch))
+        else:
+            status.documents += len(batch)
+            if report is not None:
+                status.chunks += report.chunks
+                status.embeddings_saved += report.embeddings_saved
+                status.duplicate_documents += report.duplicate_documents
+            if settings.enable_metrics:
+                from src.observability.metrics import get_metrics
+                get_metrics().record_ingest(len(batch))
+        status.batches += 1
+        self._update(status)
+
+    def _error(self, status: IngestStatus, message: str, count: int = 1):
+        status.errors += count
+        if len(status.error_samples) < MAX_ERROR_SAMPLES:
+            status.error_samples.append(message)
+        if settings.enable_metrics:
+            from src.observability.metrics import get_metrics
+            get_metrics().record_ingest(0, errors=count)
+
+    def _update(self, status: IngestStatus):
+        elapsed = (status.finished_at or time.time()) - (status.started_at or status.created_at)
+        status.docs_per_second = status.documents / elapsed if elapsed > 0 else 0.0
+        status.progress = status.bytes_read / status.bytes_total if status.bytes_total else 1.0
+        self._save(status)
+
+    def _save(self, status: IngestStatus):
+        try:
+            self.status_dir.mkdir(parents=True, exist_ok=True)
+            tmp = self.status_dir / f"{status.job_id}.json.tmp"
+            tmp.write_text(status.model_dump_json(), encoding="utf-8")
+            tmp.replace(self.status_dir / f"{status.job_id}.json")
+        except OSError as e:
+            logger.warning(f"Não foi possível gravar o estado do job: {e}")
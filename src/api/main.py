@@ -3,14 +3,20 @@ main.py
 API FastAPI do RAG Enterprise.
 """
 
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Optional
+from fastapi.responses import JSONResponse
+from typing import List
 import logging
+import time
 
 from src.config import settings
-from src.models import QueryRequest, QueryResponse
-from src.rag.pipeline import RAGPipeline
+from src.models import IngestStatus, QueryRequest, QueryResponse
+from src.observability.metrics import get_metrics
+from src.rag.pipeline import RAGPipeline, get_shared_pipeline
+from src.api.admission import AdmissionController, Overloaded, RateLimiter
+from src.api.ingest import NDJSON_TYPES, IngestManager, spool_stream, spool_upload
 
 logger = logging.getLogger(__name__)
 
@@ -30,16 +36,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Pipeline global
-rag_pipeline: Optional[RAGPipeline] = None
+# Controle de admissão (por processo)
+rate_limiter = RateLimiter()
+admission = AdmissionController()
+
+# Jobs de ingestão em lote
+ingest_jobs = IngestManager()
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    """Rejeição rápida com Retry-After."""
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.reason},
+        headers=exc.headers
+    )
 
 
 def get_pipeline() -> RAGPipeline:
-    """Retorna pipeline RAG."""
-    global rag_pipeline
-    if rag_pipeline is None:
-        rag_pipeline = RAGPipeline()
-    return rag_pipeline
+    """Retorna pipeline RAG (compartilhado no processo)."""
+    return get_shared_pipeline()
 
 
 async def verify_api_key(x_api_key: str = Header(None)):
@@ -49,24 +66,92 @@ async def verify_api_key(x_api_key: str = Header(None)):
     return x_api_key
 
 
+async def admit(
+    request: Request,
+    api_key: str = Depends(verify_api_key),
+    x_priority: str = Header("normal")
+):
+    """Rate limit por API key + fila com prioridade e concorrência adaptativa."""
+    try:
+        rate_limiter.check(api_key or (request.client.host if request.client else "anonymous"))
+    except Overloaded:
+        if settings.enable_metrics:
+            get_metrics().record_rejection("rate_limited")
+        raise
+    
+    await admission.acquire(x_priority)
+    start = time.monotonic()
+    error = False
+    upstream = True
+    try:
+        yield
+        # Respostas do cache não dizem nada sobre o upstream
+        upstream = getattr(request.state, "upstream", True)
+    except HTTPException as e:
+        error = e.status_code >= 500
+        upstream = error
+        raise
+    except Exception:
+        error = True
+        raise
+    finally:
+        admission.release(time.monotonic() - start, error=error, upstream=upstream)
+
+
 @app.get("/health")
 async def health():
     """Health check."""
     return {"status": "healthy", "version": "1.0.0"}
 
 
-@app.post("/query", response_model=QueryResponse)
+@app.get("/ready")
+async def ready(response: Response, pipeline: RAGPipeline = Depends(get_pipeline)):
+    """Readiness: só fica pronto com os índices carregados."""
+    if not pipeline.is_ready:
+        response.status_code = 503
+        return {"status": "loading"}
+    return {"status": "ready", "documents": len(pipeline.documents)}
+
+
+@app.post("/query", response_model=QueryResponse, response_model_exclude_none=True)
 async def query(
     request: QueryRequest,
+    http_request: Request,
+    response: Response,
     pipeline: RAGPipeline = Depends(get_pipeline),
-    api_key: str = Depends(verify_api_key)
+    _: None = Depends(admit),
+    x_debug: str = Header(None)
 ):
-    """Processa uma pergunta."""
+    """Processa uma pergunta.
+    
+    Com `X-Debug: 1` a resposta traz o trace (tempo por etapa, candidatos,
+    cache hits, tokens) e o header Server-Timing; `X-Debug: profile` anexa
+    também o profile da requisição.
+    """
+    from src.observability.trace import request_trace
+    
+    debug = settings.debug_header_enabled and (x_debug or "").strip().lower() not in ("", "0", "false")
+    profile = debug and x_debug.strip().lower() == "profile"
+    
+    def run():
+        with request_trace("query", profile=profile) as trace:
+            return pipeline.process(request.question, request.k, request.strategy), trace
+    
     try:
-        result = pipeline.process(request.question, request.k)
+        result, trace = await run_in_threadpool(run)
+        http_request.state.upstream = result.strategy_used != "cache"
+        response.headers["X-Request-Id"] = trace.request_id
+        if debug:
+            response.headers["Server-Timing"] = trace.server_timing()
+            result = result.model_copy(update={"debug": trace.to_dict()})
         return result
     except Exception as e:
+        from src.rag.llm import DeadlineExceeded, LLMUnavailableError
         logger.error(f"Erro ao processar query: {e}")
+        if isinstance(e, DeadlineExceeded):
+            raise HTTPException(status_code=504, detail=str(e))
+        if isinstance(e, LLMUnavailableError):
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(settings.circuit_reset_timeout))})
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -78,26 +163,66 @@ async def add_documents(
 ):
     """Adiciona documentos."""
     try:
-        pipeline.add_documents(documents)
-        return {"status": "ok", "count": len(documents)}
+        report = pipeline.add_documents(documents)
+        return {
+            "status": "ok",
+            "count": len(documents),
+            **report.model_dump(),
+            "embeddings_saved": report.embeddings_saved
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/documents/bulk", response_model=IngestStatus, status_code=202)
+async def add_documents_bulk(
+    request: Request,
+    pipeline: RAGPipeline = Depends(get_pipeline),
+    api_key: str = Depends(verify_api_key)
+):
+    """Ingestão em lote (NDJSON ou multipart), indexada em background."""
+    from starlette.datastructures import UploadFile
+    
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "multipart/form-data":
+        form = await request.form()
+        uploads = [value for _, value in form.multi_items() if isinstance(value, UploadFile)]
+        if not uploads:
+            raise HTTPException(status_code=400, detail="Nenhum arquivo enviado")
+        sources = [await run_in_threadpool(spool_upload, u.file, u.filename) for u in uploads]
+    elif content_type in NDJSON_TYPES:
+        sources = [await spool_stream(request.stream())]
+    else:
+        raise HTTPException(status_code=415, detail="Use application/x-ndjson ou multipart/form-data")
+    
+    return ingest_jobs.submit(pipeline, sources)
+
+
+@app.get("/documents/jobs/{job_id}", response_model=IngestStatus)
+async def ingest_status(job_id: str, api_key: str = Depends(verify_api_key)):
+    """Progresso, throughput e erros de um job de ingestão."""
+    status = ingest_jobs.get(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return status
+
+
 @app.get("/stats")
 async def stats(
     pipeline: RAGPipeline = Depends(get_pipeline),
     api_key: str = Depends(verify_api_key)
 ):
     """Retorna estatísticas."""
-    return pipeline.get_stats()
+    stats = pipeline.get_stats()
+    stats["admission"] = admission.get_stats()
+    return stats
 
 
 @app.get("/metrics")
 async def metrics():
     """Métricas Prometheus."""
-    from prometheus_client import generate_latest
-    return generate_latest()
+    from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 
 def start_api():
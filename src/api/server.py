@@ -0,0 +1,157 @@
+"""
+server.py
+Servidor de produção pre-fork do RAG Enterprise.
+
+O processo master carrega o índice léxico e o corpus uma única vez,
+congela o heap (gc.freeze) e faz fork dos workers, que compartilham
+essas páginas copy-on-write e aceitam conexões no mesmo socket.
+A coleção Chroma (SQLite) é aberta em cada worker após o fork.
+Documentos acrescentados por um worker chegam aos demais pelo corpus
+em disco (DocumentStore.refresh).
+
+Execute com: python -m src.api.server --workers 4
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Worker que morre antes disso conta como falha na partida: o master
+# espera (backoff exponencial) antes de reiniciar e desiste após
+# MAX_STARTUP_CRASHES falhas seguidas
+WORKER_MIN_UPTIME = 10.0
+MAX_STARTUP_CRASHES = 5
+RESPAWN_BACKOFF = 0.5
+MAX_RESPAWN_BACKOFF = 30.0
+
+
+def _bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(sock: socket.socket):
+    """Executa um worker uvicorn no socket herdado."""
+    import uvicorn
+    from src.api import main
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    pipeline = main.get_pipeline()
+    if pipeline.documents and pipeline.vector_store is None:
+        pipeline.attach_vector_store()
+
+    config = uvicorn.Config(main.app, log_level=settings.log_level.lower())
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve(workers: int = None, host: str = None, port: int = None) -> int:
+    """Carrega os índices no master e faz fork dos workers.
+
+    Retorna o código de saída do master (1 se os workers não sobem).
+    """
+    from src.rag.pipeline import RAGPipeline, set_shared_pipeline
+
+    workers = workers or settings.api_workers or os.cpu_count() or 1
+    host = host or settings.api_host
+    port = port or settings.api_port
+
+    # Carrega só o que é seguro compartilhar entre processos
+    pipeline = RAGPipeline()
+    pipeline.load_index(vector_store=False)
+    set_shared_pipeline(pipeline)
+
+    gc.collect()
+    gc.freeze()
+
+    sock = _bind_socket(host, port)
+    children = {}  # pid -> instante do fork
+    stopping = False
+    crashes = 0
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(sock)
+            except BaseException:
+                logger.exception(f"Worker {os.getpid()} falhou")
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        children[pid] = time.monotonic()
+        logger.info(f"Worker {pid} iniciado")
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    logger.info(f"Master {os.getpid()}: {len(pipeline.documents)} docs, {workers} workers em {host}:{port}")
+    for _ in range(workers):
+        spawn()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        uptime = time.monotonic() - children.pop(pid, time.monotonic())
+        if stopping:
+            continue
+
+        code = os.waitstatus_to_exitcode(status)
+        crashes = crashes + 1 if uptime < WORKER_MIN_UPTIME else 0
+        if crashes >= MAX_STARTUP_CRASHES:
+            logger.error(f"{crashes} workers falharam na partida seguidos (último: {code}), encerrando")
+            shutdown(None, None)
+            continue
+        delay = min(MAX_RESPAWN_BACKOFF, RESPAWN_BACKOFF * 2 ** (crashes - 1)) if crashes else 0.0
+        logger.warning(f"Worker {pid} terminou (código {code}), reiniciando em {delay:.1f}s")
+        time.sleep(delay)
+        if not stopping:
+            spawn()
+
+    sock.close()
+    return 1 if crashes >= MAX_STARTUP_CRASHES else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG Enterprise - servidor pre-fork")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--port", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=settings.log_level, stream=sys.stdout)
+    sys.exit(serve(args.workers, args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
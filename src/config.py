@@ -15,14 +15,49 @@ class Settings(BaseSettings):
     
     # Modelos
     default_model: str = Field(default="gpt-4o-mini")
+    fallback_model: str = Field(default="gpt-4.1-nano")
     embedding_model: str = Field(default="text-embedding-3-small")
     
+    # Cliente LLM
+    openai_base_url: str = Field(default="")
+    llm_timeout: float = Field(default=30.0)
+    llm_max_connections: int = Field(default=100)
+    llm_max_keepalive: int = Field(default=20)
+    llm_hedge_quantile: float = Field(default=0.95)
+    llm_hedge_min_samples: int = Field(default=20)
+    llm_slow_threshold: float = Field(default=10.0)
+    circuit_failure_threshold: int = Field(default=5)
+    circuit_reset_timeout: float = Field(default=30.0)
+    request_budget: float = Field(default=60.0)
+    embedding_batch_window_ms: float = Field(default=5.0)  # 0 desliga
+    embedding_batch_size: int = Field(default=64)
+    
     # RAG
     retriever_k: int = Field(default=10)
     rerank_k: int = Field(default=5)
     hybrid_semantic_weight: float = Field(default=0.5)
     hybrid_bm25_weight: float = Field(default=0.5)
     
+    # Analisador léxico
+    lexical_fold_accents: bool = Field(default=True)
+    lexical_stopwords: bool = Field(default=True)
+    lexical_stemming: bool = Field(default=True)
+    
+    # Quase-duplicatas na ingestão (Jaccard estimado por MinHash)
+    dedup_enabled: bool = Field(default=True)
+    dedup_threshold: float = Field(default=0.85)
+    dedup_num_perm: int = Field(default=64)
+    
+    # Roteamento adaptativo
+    answer_cache_size: int = Field(default=256)
+    answer_cache_ttl: float = Field(default=3600.0)
+    answer_cache_min_confidence: float = Field(default=0.8)
+    
+    # Retrieval distribuído (URLs separadas por vírgula)
+    shard_urls: str = Field(default="")
+    shard_timeout: float = Field(default=2.0)  # por chamada HTTP a um shard
+    shard_write_timeout: float = Field(default=120.0)  # /add com embeddings
+    
     # Self-Evaluation
     support_threshold: str = Field(default="partially")
     utility_threshold: int = Field(default=3)
@@ -32,16 +67,39 @@ class Settings(BaseSettings):
     api_host: str = Field(default="0.0.0.0")
     api_port: int = Field(default=8000)
     api_key: str = Field(default="")
-    rate_limit: int = Field(default=100)
+    rate_limit: int = Field(default=100)  # req/min por API key
+    rate_limit_burst: int = Field(default=20)
+    
+    # Controle de admissão
+    admission_initial_concurrency: int = Field(default=8)
+    admission_min_concurrency: int = Field(default=2)
+    admission_max_concurrency: int = Field(default=64)
+    admission_queue_size: int = Field(default=128)
+    admission_max_wait: float = Field(default=5.0)
+    admission_latency_tolerance: float = Field(default=2.0)
+    admission_latency_window: int = Field(default=200)  # latências da linha de base (mediana)
+    admission_latency_sample: int = Field(default=20)  # requisições por ajuste do limite
+    api_workers: int = Field(default=0)  # 0 = um worker por CPU
+    
+    # Ingestão em lote
+    ingest_batch_size: int = Field(default=256)  # documentos por lote
+    ingest_max_jobs: int = Field(default=100)  # jobs mantidos em memória
+    ingest_max_document_bytes: int = Field(default=10_000_000)  # por arquivo de texto ou linha NDJSON
     
     # Vector Store
     chroma_dir: str = Field(default="./data/chroma")
     collection_name: str = Field(default="rag_enterprise")
+    index_dir: str = Field(default="./data/index")
     
     # Observability
     log_level: str = Field(default="INFO")
     enable_metrics: bool = Field(default=True)
     metrics_port: int = Field(default=9090)
+    slow_query_ms: float = Field(default=5000.0)  # acima disso vai para o log de queries lentas
+    slow_query_log: str = Field(default="")  # arquivo JSON lines (vazio: só o logger)
+    debug_header_enabled: bool = Field(default=False)  # aceita X-Debug em /query (expõe traces e profiles)
+    profiler: str = Field(default="cprofile")  # cprofile ou pyinstrument
+    profile_top_n: int = Field(default=30)  # funções no relatório do cProfile
     
     # Environment
     environment: str = Field(default="development")
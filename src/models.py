@@ -3,7 +3,7 @@ models.py
 Schemas Pydantic para o RAG Enterprise.
 """
 
-from typing import List, Optional, Dict, Any
+from typing import List, Literal, Optional, Dict, Any
 from pydantic import BaseModel, Field
 from datetime import datetime
 
@@ -27,7 +27,7 @@ class SearchResult(BaseModel):
 class QueryRequest(BaseModel):
     """Request para query."""
     question: str
-    strategy: str = "auto"
+    strategy: Literal["auto", "hybrid", "semantic", "bm25", "cache"] = "auto"
     k: int = 5
     stream: bool = False
 
@@ -41,6 +41,14 @@ class QueryResponse(BaseModel):
     tokens_used: int = 0
     strategy_used: str = ""
     was_refined: bool = False
+    debug: Optional[Dict[str, Any]] = None  # trace da requisição (header X-Debug)
+
+
+class RouteDecision(BaseModel):
+    """Decisão do roteador de queries."""
+    strategy: str
+    reason: str = ""
+    identifiers: List[str] = Field(default_factory=list)
 
 
 class EvaluationResult(BaseModel):
@@ -51,6 +59,50 @@ class EvaluationResult(BaseModel):
     needs_refinement: bool = False
 
 
+class RefinementResult(BaseModel):
+    """Resultado de uma tentativa de refinamento."""
+    answer: str
+    context: List[SearchResult] = Field(default_factory=list)
+    evaluation: EvaluationResult
+    improved: bool = False
+    quality_gain: int = 0
+    tokens_used: int = 0
+    latency_ms: float = 0.0
+
+
+class IngestReport(BaseModel):
+    """Resumo de uma chamada de indexação."""
+    documents: int = 0
+    chunks: int = 0
+    duplicate_chunks: int = 0
+    duplicate_documents: int = 0
+    
+    @property
+    def embeddings_saved(self) -> int:
+        """Chunks que não precisaram de embedding."""
+        return self.duplicate_chunks
+
+
+class IngestStatus(BaseModel):
+    """Estado de um job de ingestão em lote."""
+    job_id: str
+    state: str = "queued"  # queued, running, done, failed
+    documents: int = 0
+    batches: int = 0
+    chunks: int = 0
+    embeddings_saved: int = 0
+    duplicate_documents: int = 0
+    errors: int = 0
+    error_samples: List[str] = Field(default_factory=list)
+    bytes_read: int = 0
+    bytes_total: int = 0
+    progress: float = 0.0
+    docs_per_second: float = 0.0
+    created_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+
 class AgentState(BaseModel):
     """Estado dos agentes."""
     query: str
@@ -1,5 +1,5 @@
 """Observability Module - Métricas e Logging."""
 
-from src.observability.metrics import MetricsCollector
+from src.observability.metrics import MetricsCollector, get_metrics
 
-__all__ = ["MetricsCollector"]
+__all__ = ["MetricsCollector", "get_metrics"]
@@ -3,41 +3,154 @@ metrics.py
 Métricas Prometheus para RAG Enterprise.
 """
 
-from prometheus_client import Counter, Histogram, Gauge
+import threading
 import time
 from contextlib import contextmanager
 
 
 class MetricsCollector:
-    """Coletor de métricas."""
+    """Coletor de métricas.
     
-    def __init__(self):
+    Instâncias avulsas usam um registry próprio; o singleton do processo
+    (get_metrics) registra no registry global exposto em /metrics.
+    """
+    
+    def __init__(self, registry=None):
+        from prometheus_client import CollectorRegistry, Counter, Histogram, Gauge
+        self.registry = registry if registry is not None else CollectorRegistry()
+        
         # Latência
         self.latency = Histogram(
             'rag_latency_seconds',
             'Latência por etapa',
-            ['stage']
+            ['stage'],
+            registry=self.registry
         )
         
         # Tokens
         self.tokens = Counter(
             'rag_tokens_total',
             'Total de tokens usados',
-            ['type']
+            ['type'],
+            registry=self.registry
         )
         
         # Queries
         self.queries = Counter(
             'rag_queries_total',
             'Total de queries',
-            ['status']
+            ['status'],
+            registry=self.registry
         )
         
         # Qualidade
         self.quality = Gauge(
             'rag_quality_score',
             'Score de qualidade',
-            ['metric']
+            ['metric'],
+            registry=self.registry
+        )
+        
+        # Roteamento
+        self.routes = Counter(
+            'rag_route_total',
+            'Decisões do roteador',
+            ['route', 'reason'],
+            registry=self.registry
+        )
+        self.route_latency = Histogram(
+            'rag_route_latency_seconds',
+            'Latência ponta a ponta por rota',
+            ['route'],
+            registry=self.registry
+        )
+        self.skipped = Counter(
+            'rag_stages_skipped_total',
+            'Etapas puladas pelo roteador',
+            ['stage'],
+            registry=self.registry
+        )
+    
+        # Refinamento
+        self.refinements = Counter(
+            'rag_refinements_total',
+            'Tentativas de refinamento por resultado',
+            ['outcome'],
+            registry=self.registry
+        )
+        self.refinement_latency = Histogram(
+            'rag_refinement_latency_seconds',
+            'Latência por tentativa de refinamento',
+            registry=self.registry
+        )
+        self.refinement_tokens = Histogram(
+            'rag_refinement_tokens',
+            'Tokens por tentativa de refinamento',
+            buckets=(100, 250, 500, 1000, 2000, 4000, 8000),
+            registry=self.registry
+        )
+        self.refinement_gain = Histogram(
+            'rag_refinement_quality_gain',
+            'Variação de utility por tentativa de refinamento',
+            buckets=(-4, -2, -1, 0, 1, 2, 4),
+            registry=self.registry
+        )
+    
+        # Controle de admissão
+        self.admission = Gauge(
+            'rag_admission',
+            'Estado do controle de admissão',
+            ['metric'],
+            registry=self.registry
+        )
+        self.rejections = Counter(
+            'rag_rejected_total',
+            'Requisições rejeitadas',
+            ['reason'],
+            registry=self.registry
+        )
+    
+        # Cliente LLM
+        self.llm_calls = Counter(
+            'rag_llm_calls_total',
+            'Chamadas ao LLM por modelo e resultado',
+            ['model', 'status'],
+            registry=self.registry
+        )
+    
+        # Micro-batching de embeddings
+        self.embedding_batcher = Gauge(
+            'rag_embedding_batcher',
+            'Configuração do micro-batcher de embeddings',
+            ['setting'],
+            registry=self.registry
+        )
+        self.embedding_batch_size = Histogram(
+            'rag_embedding_batch_size',
+            'Queries por chamada de embedding',
+            buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+            registry=self.registry
+        )
+    
+        # Ingestão
+        self.ingested = Counter(
+            'rag_ingested_documents_total',
+            'Documentos recebidos pela ingestão em lote',
+            ['status'],
+            registry=self.registry
+        )
+        self.duplicates = Counter(
+            'rag_dedup_total',
+            'Quase-duplicatas colapsadas na ingestão',
+            ['level'],
+            registry=self.registry
+        )
+        
+        self.slow_queries = Counter(
+            'rag_slow_queries_total',
+            'Requisições acima de slow_query_ms',
+            ['name'],
+            registry=self.registry
         )
     
     @contextmanager
@@ -60,7 +173,83 @@ class MetricsCollector:
     def set_quality(self, metric: str, value: float):
         """Define score de qualidade."""
         self.quality.labels(metric=metric).set(value)
+    
+    def record_route(self, route: str, reason: str = ""):
+        """Registra decisão de roteamento."""
+        self.routes.labels(route=route, reason=reason).inc()
+    
+    def record_route_latency(self, route: str, seconds: float):
+        """Registra latência total de uma query por rota."""
+        self.route_latency.labels(route=route).observe(seconds)
+    
+    def record_refinement(self, outcome: str, seconds: float = 0.0, tokens: int = 0, gain: int = 0):
+        """Registra custo e ganho de uma tentativa de refinamento."""
+        self.refinements.labels(outcome=outcome).inc()
+        if outcome != "unchanged":
+            self.refinement_latency.observe(seconds)
+            self.refinement_tokens.observe(tokens)
+            self.refinement_gain.observe(gain)
+    
+    def set_admission(self, limit: float, in_flight: int, queued: int):
+        """Atualiza limite de concorrência, requisições ativas e fila."""
+        self.admission.labels(metric="concurrency_limit").set(limit)
+        self.admission.labels(metric="in_flight").set(in_flight)
+        self.admission.labels(metric="queued").set(queued)
+    
+    def record_rejection(self, reason: str):
+        """Registra requisição rejeitada (429/503)."""
+        self.rejections.labels(reason=reason).inc()
+    
+    def record_llm_call(self, model: str, status: str):
+        """Registra chamada ao LLM (primary/fallback, ok/error)."""
+        self.llm_calls.labels(model=model, status=status).inc()
+    
+    def set_embedding_batcher(self, window: float, max_batch: int):
+        """Publica janela (s) e tamanho máximo do micro-batcher."""
+        self.embedding_batcher.labels(setting="window_seconds").set(window)
+        self.embedding_batcher.labels(setting="max_batch").set(max_batch)
+    
+    def record_embedding_batch(self, size: int, seconds: float):
+        """Registra uma chamada de embedding agrupada."""
+        self.embedding_batch_size.observe(size)
+        self.latency.labels(stage="embedding_batch").observe(seconds)
+    
+    def record_ingest(self, documents: int, errors: int = 0):
+        """Registra documentos indexados e rejeitados na ingestão."""
+        self.ingested.labels(status="ok").inc(documents)
+        self.ingested.labels(status="error").inc(errors)
+    
+    def record_dedup(self, chunks: int, documents: int = 0):
+        """Registra chunks (embeddings poupados) e documentos duplicados."""
+        self.duplicates.labels(level="chunk").inc(chunks)
+        self.duplicates.labels(level="document").inc(documents)
+    
+    def record_slow_query(self, name: str = "query"):
+        """Registra requisição acima de slow_query_ms."""
+        self.slow_queries.labels(name=name).inc()
+    
+    def record_skip(self, stage: str):
+        """Registra etapa pulada."""
+        self.skipped.labels(stage=stage).inc()
+
+
+# Singleton (criado no primeiro uso)
+_metrics: MetricsCollector = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> MetricsCollector:
+    """Retorna o coletor do processo."""
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                from prometheus_client import REGISTRY
+                _metrics = MetricsCollector(registry=REGISTRY)
+    return _metrics
 
 
-# Singleton
-metrics = MetricsCollector()
+def __getattr__(name):
+    if name == "metrics":
+        return get_metrics()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
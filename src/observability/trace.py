@@ -0,0 +1,203 @@
+"""
+trace.py
+Trace por requisição: tempo por etapa, candidatos, cache hits e tokens,
+log de queries lentas e profiling opcional.
+"""
+
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from src.config import settings
+
+slow_query_logger = logging.getLogger("rag.slow_queries")
+_slow_log_ready = False
+
+
+class RequestTrace:
+    """Registro de uma requisição.
+
+    Etapas podem ser abertas de várias threads (hedging, nós do grafo em
+    executor); cada uma guarda início relativo e duração em ms.
+    """
+
+    def __init__(self, name: str = "query", request_id: str = None):
+        self.request_id = request_id or uuid.uuid4().hex[:16]
+        self.name = name
+        self.timestamp = time.time()
+        self.started = time.perf_counter()
+        self.stages: List[Dict[str, Any]] = []
+        self.counters: Dict[str, int] = {}
+        self.attributes: Dict[str, Any] = {}
+        self.profile: Optional[str] = None
+        self.total_ms: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, **info):
+        """Mede uma etapa; o dict retornado aceita dados extras (candidates...)."""
+        start = time.perf_counter()
+        entry = {"stage": name, "start_ms": round((start - self.started) * 1000, 3), **info}
+        try:
+            yield entry
+        finally:
+            entry["ms"] = round((time.perf_counter() - start) * 1000, 3)
+            with self._lock:
+                self.stages.append(entry)
+
+    def count(self, key: str, n: int = 1):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self) -> float:
+        self.total_ms = round((time.perf_counter() - self.started) * 1000, 3)
+        return self.total_ms
+
+    def server_timing(self) -> str:
+        """Header Server-Timing com o tempo somado por etapa."""
+        totals: Dict[str, float] = {}
+        for entry in self.stages:
+            key = entry["stage"].replace(":", "-")
+            totals[key] = totals.get(key, 0.0) + entry["ms"]
+        parts = [f"{name};dur={ms:.1f}" for name, ms in totals.items()]
+        if self.total_ms is not None:
+            parts.append(f"total;dur={self.total_ms:.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> dict:
+        data = {
+            "request_id": self.request_id,
+            "name": self.name,
+            "timestamp": self.timestamp,
+            "total_ms": self.total_ms,
+            "stages": sorted(self.stages, key=lambda e: e["start_ms"]),
+            "counters": dict(self.counters),
+            **self.attributes
+        }
+        if self.profile is not None:
+            data["profile"] = self.profile
+        return data
+
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar(
+    "rag_trace", default=None
+)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def request_trace(name: str = "query", profile: bool = False, request_id: str = None):
+    """Abre o trace da requisição; chamadas aninhadas reusam o trace atual.
+
+    Ao fechar, requisições acima de settings.slow_query_ms vão para o log
+    de queries lentas.
+    """
+    existing = _current_trace.get()
+    if existing is not None:
+        yield existing
+        return
+
+    trace = RequestTrace(name, request_id)
+    token = _current_trace.set(trace)
+    profiler = _start_profiler() if profile else None
+    try:
+        yield trace
+    except BaseException as e:
+        trace.set(error=type(e).__name__)
+        raise
+    finally:
+        if profiler is not None:
+            trace.profile = _stop_profiler(profiler)
+        trace.finish()
+        _current_trace.reset(token)
+        if trace.total_ms >= settings.slow_query_ms:
+            log_slow_query(trace)
+
+
+@contextmanager
+def trace_stage(name: str, **info):
+    """Etapa no trace atual (no-op fora de uma requisição)."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield {}
+        return
+    with trace.stage(name, **info) as entry:
+        yield entry
+
+
+def trace_count(key: str, n: int = 1):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count(key, n)
+
+
+def trace_set(**attributes):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.set(**attributes)
+
+
+def log_slow_query(trace: RequestTrace):
+    """Uma linha JSON por query lenta (logger rag.slow_queries)."""
+    global _slow_log_ready
+    if not _slow_log_ready:
+        if settings.slow_query_log:
+            handler = logging.FileHandler(settings.slow_query_log, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            slow_query_logger.addHandler(handler)
+        _slow_log_ready = True
+
+    data = trace.to_dict()
+    data.pop("profile", None)
+    slow_query_logger.warning(json.dumps(data, ensure_ascii=False, default=str))
+    if settings.enable_metrics:
+        from src.observability.metrics import get_metrics
+        get_metrics().record_slow_query(trace.name)
+
+
+# Profiling (só a thread da requisição)
+
+def _start_profiler():
+    if settings.profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            pass
+        else:
+            profiler = Profiler(async_mode="disabled")
+            profiler.start()
+            return profiler
+
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Outro profiler já ativo no processo
+        return None
+    return profiler
+
+
+def _stop_profiler(profiler) -> str:
+    import cProfile
+    if not isinstance(profiler, cProfile.Profile):
+        profiler.stop()
+        return profiler.output_text(unicode=True, color=False)
+
+    import io
+    import pstats
+    profiler.disable()
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(settings.profile_top_n)
+    return out.getvalue()
@@ -1,5 +1,5 @@
 """RAG Pipeline - Componentes de Retrieval-Augmented Generation."""
 
-from src.rag.pipeline import RAGPipeline
+from src.rag.pipeline import RAGPipeline, get_shared_pipeline, set_shared_pipeline
 
-__all__ = ["RAGPipeline"]
+__all__ = ["RAGPipeline", "get_shared_pipeline", "set_shared_pipeline"]
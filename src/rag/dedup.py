@@ -0,0 +1,110 @@
+"""
+dedup.py
+Detecção de quase-duplicatas na ingestão (MinHash + LSH em bandas).
+"""
+
+import hashlib
+import zlib
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from src.config import settings
+from src.rag.lexical import tokenize
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def shingles(tokens: List[str], size: int = 3) -> Iterable[int]:
+    """Hashes dos n-gramas de palavras do texto já analisado."""
+    if len(tokens) < size:
+        grams = [" ".join(tokens)]
+    else:
+        grams = [" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)]
+    return {zlib.crc32(g.encode("utf-8")) for g in grams}
+
+
+class MinHasher:
+    """Assinaturas MinHash com permutações (a*x + b) mod p."""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, hashes: Iterable[int]) -> np.ndarray:
+        values = np.fromiter(hashes, dtype=np.uint64)
+        permuted = np.bitwise_and((np.outer(values, self.a) + self.b) % MERSENNE_PRIME, MAX_HASH)
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    """Índice de chunks para detectar quase-duplicatas.
+
+    Textos idênticos após a análise léxica são resolvidos por hash; os
+    demais são candidatos quando colidem em alguma banda do LSH e viram
+    duplicata se a similaridade de Jaccard estimada >= threshold.
+    """
+
+    def __init__(self, threshold: float = None, num_perm: int = None, rows: int = 4):
+        self.threshold = threshold or settings.dedup_threshold
+        self.hasher = MinHasher(num_perm or settings.dedup_num_perm)
+        self.rows = rows
+        self.bands = self.hasher.num_perm // rows
+        self.buckets: List[Dict[bytes, List[str]]] = [{} for _ in range(self.bands)]
+        self.signatures: Dict[str, np.ndarray] = {}
+        self.exact: Dict[str, str] = {}
+        self.digests: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def add(self, key: str, text: str) -> Optional[str]:
+        """Registra o texto; se for quase-duplicata retorna a chave canônica."""
+        tokens = tokenize(text)
+        if not tokens:
+            return None
+
+        digest = hashlib.sha1(" ".join(tokens).encode("utf-8")).hexdigest()
+        if digest in self.exact:
+            return self.exact[digest]
+
+        signature = self.hasher.signature(shingles(tokens))
+        bands = self._bands(signature)
+
+        best, best_similarity = None, self.threshold
+        seen = set()
+        for band, bucket in zip(bands, self.buckets):
+            for candidate in bucket.get(band, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                similarity = float(np.mean(signature == self.signatures[candidate]))
+                if similarity >= best_similarity:
+                    best, best_similarity = candidate, similarity
+        if best is not None:
+            return best
+
+        self.exact[digest] = key
+        self.digests[key] = digest
+        self.signatures[key] = signature
+        for band, bucket in zip(bands, self.buckets):
+            bucket.setdefault(band, []).append(key)
+        return None
+
+    def remove(self, key: str):
+        """Desfaz o registro de `key` (ingestão que não chegou ao vector store)."""
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        del self.exact[self.digests.pop(key)]
+        for band, bucket in zip(self._bands(signature), self.buckets):
+            keys = bucket[band]
+            keys.remove(key)
+            if not keys:
+                del bucket[band]
+
+    def _bands(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
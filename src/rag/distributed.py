@@ -0,0 +1,336 @@
+"""
+distributed.py
+Retrieval distribuído (scatter-gather) sobre shards do índice.
+
+O corpus é particionado por hash do id do chunk entre N shards. Cada shard
+executa os ramos semântico e léxico sobre sua partição; o coordenador
+dispara as buscas em paralelo, injeta o IDF global do BM25 e funde as
+listas parciais com RRF.
+
+Shard remoto:
+    python -m src.rag.distributed --port 9101 --shard-id 0
+"""
+
+import argparse
+import logging
+import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from src.config import settings
+from src.models import SearchResult
+from src.rag.lexical import BM25Index, bm25_idf, tokenize
+
+logger = logging.getLogger(__name__)
+
+DOC_ID_RE = re.compile(r'^doc_(\d+):')
+
+
+def shard_for(chunk_id: str, n_shards: int) -> int:
+    """Shard responsável por um chunk (hash estável entre processos)."""
+    return zlib.crc32(chunk_id.encode("utf-8")) % n_shards
+
+
+class ShardWorker:
+    """Partição do corpus com ramos semântico e léxico."""
+
+    def __init__(self, shard_id: int = 0):
+        self.shard_id = shard_id
+        self.bm25 = BM25Index()
+        self.chunks: Dict[str, Dict[str, Any]] = {}
+        self.vector_ids: List[str] = []
+        self.vectors: Optional[np.ndarray] = None
+        self.next_document = 0
+
+    def add(self, chunks: List[Dict[str, Any]]) -> int:
+        """Indexa chunks: {id, content, source, embedding?}.
+
+        Ids já indexados são rejeitados (ValueError) antes de qualquer escrita.
+        """
+        ids = [chunk["id"] for chunk in chunks]
+        existing = [cid for cid in ids if cid in self.chunks]
+        if existing or len(set(ids)) != len(ids):
+            raise ValueError(f"chunks já indexados: {existing[:5] or ids}")
+
+        new_ids, new_vectors = [], []
+        for chunk in chunks:
+            self.chunks[chunk["id"]] = {"content": chunk["content"], "source": chunk.get("source", "")}
+            match = DOC_ID_RE.match(chunk["id"])
+            if match:
+                self.next_document = max(self.next_document, int(match.group(1)) + 1)
+            self.bm25.add(chunk["id"], tokenize(chunk["content"]))
+            if chunk.get("embedding") is not None:
+                new_ids.append(chunk["id"])
+                new_vectors.append(chunk["embedding"])
+
+        if new_vectors:
+            matrix = np.asarray(new_vectors, dtype=np.float32)
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+            self.vectors = matrix if self.vectors is None else np.vstack([self.vectors, matrix])
+            self.vector_ids.extend(new_ids)
+        return len(self.chunks)
+
+    def stats(self) -> Dict[str, Any]:
+        """Estatísticas locais para o BM25 global."""
+        return {
+            "shard_id": self.shard_id,
+            "n_docs": len(self.bm25),
+            "total_len": self.bm25.total_len,
+            "next_document": self.next_document,
+            "df": self.bm25.document_frequencies()
+        }
+
+    def search(
+        self,
+        tokens: List[str],
+        vector: Optional[List[float]],
+        k: int,
+        idf: Optional[Dict[str, float]] = None,
+        avgdl: Optional[float] = None
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Top-k parcial dos dois ramos."""
+        semantic = []
+        if vector is not None and self.vectors is not None:
+            query = np.asarray(vector, dtype=np.float32)
+            query /= np.linalg.norm(query) + 1e-12
+            sims = self.vectors @ query
+            top = np.argsort(-sims)[:k]
+            semantic = [self._hit(self.vector_ids[i], float(sims[i])) for i in top]
+
+        lexical = [self._hit(cid, score) for cid, score in self.bm25.search(tokens, k, idf, avgdl)]
+        return {"semantic": semantic, "lexical": lexical}
+
+    def _hit(self, chunk_id: str, score: float) -> Dict[str, Any]:
+        chunk = self.chunks[chunk_id]
+        return {"id": chunk_id, "content": chunk["content"], "source": chunk["source"], "score": score}
+
+
+class LocalShardClient:
+    """Cliente in-process para um ShardWorker."""
+
+    def __init__(self, worker: ShardWorker):
+        self.worker = worker
+        self.name = f"local:{worker.shard_id}"
+
+    def add(self, chunks: List[Dict[str, Any]]) -> int:
+        return self.worker.add(chunks)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.worker.stats()
+
+    def search(self, tokens, vector, k, idf=None, avgdl=None) -> Dict[str, List[Dict[str, Any]]]:
+        return self.worker.search(tokens, vector, k, idf, avgdl)
+
+
+class HTTPShardClient:
+    """Cliente HTTP para um shard remoto (ver create_shard_app)."""
+
+    def __init__(self, base_url: str, timeout: float = None):
+        import httpx
+        self.name = base_url.rstrip("/")
+        self.client = httpx.Client(base_url=self.name, timeout=timeout or settings.shard_timeout)
+
+    def add(self, chunks: List[Dict[str, Any]]) -> int:
+        # Lotes com embeddings são bem maiores que uma busca
+        response = self.client.post("/add", json={"chunks": chunks}, timeout=settings.shard_write_timeout)
+        if response.status_code == 409:
+            raise ValueError(response.json().get("detail", "chunks já indexados"))
+        response.raise_for_status()
+        return response.json()["count"]
+
+    def stats(self) -> Dict[str, Any]:
+        response = self.client.get("/stats")
+        response.raise_for_status()
+        return response.json()
+
+    def search(self, tokens, vector, k, idf=None, avgdl=None) -> Dict[str, List[Dict[str, Any]]]:
+        response = self.client.post("/search", json={
+            "tokens": tokens, "vector": vector, "k": k, "idf": idf, "avgdl": avgdl
+        })
+        response.raise_for_status()
+        return response.json()
+
+
+class ShardCoordinator:
+    """Coordena scatter-gather sobre os shards.
+
+    As estatísticas globais e o próximo id de documento vêm dos próprios
+    shards (refresh_stats na criação), então um coordenador novo continua
+    a numeração de shards já populados.
+    """
+
+    def __init__(self, shards: List, embeddings=None, splitter=None):
+        if not shards:
+            raise ValueError("ShardCoordinator requer ao menos um shard")
+        self.shards = shards
+        self.embeddings = embeddings
+        self.splitter = splitter
+        # Uma chamada por shard para cada query concorrente (threads criadas sob demanda)
+        self.executor = ThreadPoolExecutor(
+            max_workers=len(shards) * settings.admission_max_concurrency, thread_name_prefix="shard"
+        )
+
+        # Estatísticas globais do BM25
+        self.n_docs = 0
+        self.total_len = 0
+        self.df: Dict[str, int] = {}
+        self.n_documents = 0
+        self.partial_searches = 0
+        self.refresh_stats()
+
+    @classmethod
+    def from_urls(cls, urls: List[str], **kwargs) -> "ShardCoordinator":
+        """Cria coordenador para shards HTTP."""
+        timeout = kwargs.pop("timeout", None) or settings.shard_timeout
+        return cls([HTTPShardClient(url, timeout=timeout) for url in urls], **kwargs)
+
+    def add_documents(self, documents: List[str]) -> int:
+        """Divide em chunks, embeda e distribui entre os shards."""
+        chunks = []
+        for doc in documents:
+            doc_idx = self.n_documents
+            self.n_documents += 1
+            texts = self.splitter.split_text(doc) if self.splitter else [doc]
+            for j, text in enumerate(texts):
+                chunks.append({"id": f"doc_{doc_idx}:{j}", "content": text, "source": f"doc_{doc_idx}"})
+
+        if self.embeddings is not None and chunks:
+            vectors = self.embeddings.embed_documents([c["content"] for c in chunks])
+            for chunk, vector in zip(chunks, vectors):
+                chunk["embedding"] = list(vector)
+
+        partitions: Dict[int, List[Dict[str, Any]]] = {}
+        for chunk in chunks:
+            partitions.setdefault(shard_for(chunk["id"], len(self.shards)), []).append(chunk)
+
+        futures = [
+            self.executor.submit(self.shards[i].add, part)
+            for i, part in partitions.items()
+        ]
+        try:
+            for future in futures:
+                future.result()
+        finally:
+            # Escritas parciais também contam para df e numeração
+            self.refresh_stats()
+        logger.info(f"Distribuídos {len(documents)} docs, {len(chunks)} chunks em {len(self.shards)} shards")
+        return len(chunks)
+
+    def refresh_stats(self):
+        """Agrega N, tamanho total, df e próximo id de documento dos shards."""
+        n_docs, total_len, df = 0, 0, {}
+        for stats in self._gather(lambda shard: shard.stats()):
+            n_docs += stats["n_docs"]
+            total_len += stats["total_len"]
+            self.n_documents = max(self.n_documents, stats.get("next_document", 0))
+            for term, count in stats["df"].items():
+                df[term] = df.get(term, 0) + count
+        self.n_docs, self.total_len, self.df = n_docs, total_len, df
+
+    def search(self, query: str, k: int = None) -> List[SearchResult]:
+        """Busca híbrida distribuída com IDF global e RRF."""
+        from src.rag.pipeline import RAGPipeline
+
+        k = k or settings.retriever_k
+        tokens = tokenize(query)
+        vector = list(self.embeddings.embed_query(query)) if self.embeddings is not None else None
+        idf = {t: bm25_idf(self.n_docs, self.df.get(t, 0)) for t in set(tokens)}
+        avgdl = self.total_len / self.n_docs if self.n_docs else None
+
+        partials = self._gather(lambda shard: shard.search(tokens, vector, k, idf, avgdl))
+        semantic = self._merge([p["semantic"] for p in partials], k)
+        lexical = self._merge([p["lexical"] for p in partials], k)
+        return RAGPipeline._rrf_fusion([semantic, lexical], k)
+
+    def _gather(self, call) -> List[Any]:
+        """Executa em todos os shards; shards com erro ou timeout são omitidos.
+
+        O prazo é o timeout de cada cliente, contado quando a chamada começa:
+        o tempo na fila atrás de outras buscas não conta contra o shard.
+        """
+        futures = {self.executor.submit(call, shard): shard for shard in self.shards}
+
+        results = []
+        for future, shard in futures.items():
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.warning(f"Shard {shard.name} falhou: {e}")
+        if len(results) < len(self.shards):
+            self.partial_searches += 1
+        return results
+
+    @staticmethod
+    def _merge(lists: List[List[Dict[str, Any]]], k: int) -> List[SearchResult]:
+        hits = sorted((hit for hits in lists for hit in hits), key=lambda h: -h["score"])[:k]
+        return [
+            SearchResult(content=h["content"], score=h["score"], source=h["source"], metadata={"chunk_id": h["id"]})
+            for h in hits
+        ]
+
+    def get_stats(self) -> dict:
+        """Retorna estatísticas do cluster."""
+        return {
+            "shards": len(self.shards),
+            "chunks_indexed": self.n_docs,
+            "partial_searches": self.partial_searches
+        }
+
+
+def create_shard_app(worker: ShardWorker):
+    """App FastAPI que expõe um ShardWorker."""
+    from fastapi import FastAPI, HTTPException
+    from pydantic import BaseModel
+
+    class AddRequest(BaseModel):
+        chunks: List[Dict[str, Any]]
+
+    class SearchRequest(BaseModel):
+        tokens: List[str]
+        vector: Optional[List[float]] = None
+        k: int = 10
+        idf: Optional[Dict[str, float]] = None
+        avgdl: Optional[float] = None
+
+    app = FastAPI(title=f"RAG Shard {worker.shard_id}")
+
+    @app.get("/health")
+    def health():
+        return {"status": "healthy", "shard_id": worker.shard_id}
+
+    @app.post("/add")
+    def add(request: AddRequest):
+        try:
+            return {"count": worker.add(request.chunks)}
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
+    @app.get("/stats")
+    def stats():
+        return worker.stats()
+
+    @app.post("/search")
+    def search(request: SearchRequest):
+        return worker.search(request.tokens, request.vector, request.k, request.idf, request.avgdl)
+
+    return app
+
+
+def main():
+    """Inicia um shard HTTP."""
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="RAG Enterprise - shard de retrieval")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9101)
+    parser.add_argument("--shard-id", type=int, default=0)
+    args = parser.parse_args()
+
+    uvicorn.run(create_shard_app(ShardWorker(args.shard_id)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
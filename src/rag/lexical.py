@@ -0,0 +1,210 @@
+"""
+lexical.py
+Analisador léxico para português e índice BM25 sobre ids de termos,
+com estatísticas globais injetáveis.
+"""
+
+import heapq
+import math
+import re
+import unicodedata
+from array import array
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from src.config import settings
+
+TOKEN_RE = re.compile(r'[\w-]+')
+
+# Identificadores como CLI-2024-0892, NF-404, AUTH-401 (mantidos intactos)
+IDENTIFIER_RE = re.compile(r'\b[A-Za-z]{2,}(?:-\d+)+\b')
+
+# Já sem acentos: o analisador compara depois do folding
+STOPWORDS = frozenset("""
+a o as os um uma uns umas ao aos de do da dos das em no na nos nas num numa
+por pelo pela pelos pelas para pra com e ou que se sua seu suas seus meu minha
+este esta estes estas esse essa esses essas isso isto aquele aquela lhe lhes
+ja mas mais ate entre sobre sob apos eh e ser sao foi era sera esta estao tem
+ha qual quais como quando onde quem cujo cuja the of and to in
+""".split())
+
+# (sufixo, substituição, tamanho mínimo da palavra): plurais e advérbios
+STEM_RULES = (
+    ("mente", "", 8),
+    ("oes", "ao", 5),
+    ("aes", "ao", 5),
+    ("ais", "al", 6),
+    ("eis", "el", 6),
+    ("ois", "ol", 6),
+    ("ns", "m", 5),
+    ("res", "r", 6),
+    ("zes", "z", 5),
+)
+
+
+def fold_accents(text: str) -> str:
+    """Remove acentos e cedilha (férias -> ferias, ação -> acao)."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def stem(word: str) -> str:
+    """Stemmer leve: plurais e sufixo -mente."""
+    if len(word) < 4 or not word.isalpha():
+        return word
+    for suffix, replacement, min_len in STEM_RULES:
+        if len(word) >= min_len and word.endswith(suffix):
+            return word[:-len(suffix)] + replacement
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+class Analyzer:
+    """Tokenização configurável: acentos, stopwords e stemming.
+
+    Identificadores (CLI-2024-0892) passam sem alteração; demais tokens
+    com hífen são quebrados nas partes.
+    """
+
+    def __init__(self, fold: bool = True, stopwords: bool = True, stemming: bool = True):
+        self.fold = fold
+        self.stopwords = STOPWORDS if stopwords else frozenset()
+        self.stemming = stemming
+
+    def __call__(self, text: str) -> List[str]:
+        text = text.lower()
+        if self.fold:
+            text = fold_accents(text)
+
+        tokens = []
+        for token in TOKEN_RE.findall(text):
+            if IDENTIFIER_RE.fullmatch(token):
+                tokens.append(token)
+                continue
+            for part in token.split("-"):
+                if not part or part in self.stopwords:
+                    continue
+                tokens.append(stem(part) if self.stemming else part)
+        return tokens
+
+
+@lru_cache(maxsize=1)
+def get_analyzer() -> Analyzer:
+    """Analisador configurado em settings (igual em índice, shards e queries)."""
+    return Analyzer(
+        fold=settings.lexical_fold_accents,
+        stopwords=settings.lexical_stopwords,
+        stemming=settings.lexical_stemming
+    )
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokenizador léxico padrão."""
+    return get_analyzer()(text)
+
+
+def bm25_idf(n_docs: int, df: int) -> float:
+    """IDF do BM25 (variante não-negativa, estável entre shards)."""
+    return math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+
+class TermDictionary:
+    """Mapeia termos para ids inteiros (cada termo guardado uma vez)."""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.terms: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def add(self, term: str) -> int:
+        tid = self.ids.get(term)
+        if tid is None:
+            tid = self.ids[term] = len(self.terms)
+            self.terms.append(term)
+        return tid
+
+    def get(self, term: str) -> Optional[int]:
+        return self.ids.get(term)
+
+
+class BM25Index:
+    """Índice BM25 com postings por id de termo.
+
+    Cada posting é um par de arrays de inteiros (documentos, frequências),
+    e só os documentos que contêm os termos da query são pontuados.
+    Aceita IDF e tamanho médio externos, o que permite pontuar uma
+    partição do corpus com estatísticas do corpus inteiro.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, terms: TermDictionary = None):
+        self.k1 = k1
+        self.b = b
+        self.terms = terms if terms is not None else TermDictionary()
+        self.ids: List[str] = []
+        self.doc_len = array("I")
+        self.total_len = 0
+        self.postings: Dict[int, Tuple[array, array]] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, doc_id: str, tokens: List[str]):
+        """Indexa um documento já tokenizado."""
+        idx = len(self.ids)
+        self.ids.append(doc_id)
+        self.doc_len.append(len(tokens))
+        self.total_len += len(tokens)
+        for term, tf in Counter(tokens).items():
+            tid = self.terms.add(term)
+            posting = self.postings.get(tid)
+            if posting is None:
+                posting = self.postings[tid] = (array("I"), array("I"))
+            posting[0].append(idx)
+            posting[1].append(tf)
+
+    def document_frequencies(self) -> Dict[str, int]:
+        """Frequência de documento por termo."""
+        return {self.terms.terms[tid]: len(docs) for tid, (docs, _) in self.postings.items()}
+
+    def rank(
+        self,
+        tokens: List[str],
+        k: int,
+        idf: Optional[Dict[str, float]] = None,
+        avgdl: Optional[float] = None
+    ) -> List[Tuple[int, float]]:
+        """Os k melhores (posição do documento, score) com score > 0."""
+        n_docs = len(self.ids)
+        if not n_docs:
+            return []
+        avgdl = avgdl or self.total_len / n_docs or 1.0
+        k1, b, doc_len = self.k1, self.b, self.doc_len
+
+        scores: Dict[int, float] = {}
+        for term in set(tokens):
+            tid = self.terms.get(term)
+            posting = self.postings.get(tid) if tid is not None else None
+            if not posting:
+                continue
+            docs, tfs = posting
+            term_idf = idf.get(term, 0.0) if idf is not None else bm25_idf(n_docs, len(docs))
+            for idx, tf in zip(docs, tfs):
+                norm = k1 * (1 - b + b * doc_len[idx] / avgdl)
+                scores[idx] = scores.get(idx, 0.0) + term_idf * tf * (k1 + 1) / (tf + norm)
+
+        ranked = heapq.nlargest(k, scores.items(), key=lambda x: x[1])
+        return [(idx, s) for idx, s in ranked if s > 0]
+
+    def search(
+        self,
+        tokens: List[str],
+        k: int,
+        idf: Optional[Dict[str, float]] = None,
+        avgdl: Optional[float] = None
+    ) -> List[Tuple[str, float]]:
+        """Retorna os k melhores (doc_id, score) com score > 0."""
+        return [(self.ids[idx], s) for idx, s in self.rank(tokens, k, idf, avgdl)]
@@ -0,0 +1,599 @@
+"""
+llm.py
+Camada de clientes LLM resiliente: pool HTTP compartilhado, deadlines
+por etapa, requisições hedged, circuit breaker com modelo de fallback e
+micro-batching dos embeddings de query.
+"""
+
+import asyncio
+import contextvars
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, InvalidStateError, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import Runnable
+
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Fração do orçamento da requisição que cada etapa pode consumir
+STAGE_SHARE = {"generate": 0.5, "evaluate": 0.3, "refine": 0.5}
+
+
+class LLMUnavailableError(Exception):
+    """Modelo primário e fallback indisponíveis."""
+
+
+class DeadlineExceeded(LLMUnavailableError):
+    """Orçamento de tempo da requisição esgotado."""
+
+
+# Deadlines
+
+class Deadline:
+    """Instante limite absoluto (time.monotonic)."""
+
+    def __init__(self, seconds: float):
+        self.budget = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    def child(self, share: float) -> "Deadline":
+        """Sub-deadline para uma etapa, limitada pelo tempo restante."""
+        return Deadline(min(self.remaining(), self.budget * share))
+
+
+_current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar(
+    "rag_deadline", default=None
+)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+@contextmanager
+def request_deadline(seconds: float = None):
+    """Define o orçamento de tempo da requisição."""
+    token = _current_deadline.set(Deadline(seconds or settings.request_budget))
+    try:
+        yield _current_deadline.get()
+    finally:
+        _current_deadline.reset(token)
+
+
+@contextmanager
+def stage_deadline(stage: str):
+    """Restringe o deadline atual à fatia da etapa (no-op sem orçamento)."""
+    parent = _current_deadline.get()
+    if parent is None:
+        yield None
+        return
+    token = _current_deadline.set(parent.child(STAGE_SHARE.get(stage, 1.0)))
+    try:
+        yield _current_deadline.get()
+    finally:
+        _current_deadline.reset(token)
+
+
+def call_timeout() -> float:
+    """Timeout de uma chamada: o menor entre llm_timeout e o deadline."""
+    deadline = current_deadline()
+    if deadline is None:
+        return settings.llm_timeout
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded("Orçamento da requisição esgotado")
+    return min(settings.llm_timeout, remaining)
+
+
+# Pool HTTP compartilhado
+
+_http_clients = {}
+_http_lock = threading.Lock()
+
+
+def _limits():
+    import httpx
+    return httpx.Limits(
+        max_connections=settings.llm_max_connections,
+        max_keepalive_connections=settings.llm_max_keepalive,
+        keepalive_expiry=30.0
+    )
+
+
+def get_http_client():
+    """Cliente httpx síncrono do processo (pool compartilhado)."""
+    with _http_lock:
+        if "sync" not in _http_clients:
+            import httpx
+            _http_clients["sync"] = httpx.Client(limits=_limits(), timeout=settings.llm_timeout)
+        return _http_clients["sync"]
+
+
+def get_async_http_client():
+    """Cliente httpx assíncrono do processo (pool compartilhado)."""
+    with _http_lock:
+        if "async" not in _http_clients:
+            import httpx
+            _http_clients["async"] = httpx.AsyncClient(limits=_limits(), timeout=settings.llm_timeout)
+        return _http_clients["async"]
+
+
+def _client_kwargs() -> dict:
+    kwargs = {
+        "api_key": settings.openai_api_key,
+        "http_client": get_http_client(),
+        "http_async_client": get_async_http_client(),
+        "timeout": settings.llm_timeout,
+        "max_retries": 0
+    }
+    if settings.openai_base_url:
+        kwargs["base_url"] = settings.openai_base_url
+    return kwargs
+
+
+def build_chat_model(model: str):
+    """ChatOpenAI sobre o pool compartilhado, sem retries internos."""
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model=model, temperature=0.1, stream_usage=True, **_client_kwargs())
+
+
+def build_embeddings():
+    """OpenAIEmbeddings sobre o pool compartilhado, com micro-batching das queries."""
+    from langchain_openai import OpenAIEmbeddings
+    kwargs = _client_kwargs()
+    kwargs["max_retries"] = 2
+    embeddings = OpenAIEmbeddings(model=settings.embedding_model, **kwargs)
+    if settings.embedding_batch_window_ms <= 0:
+        return embeddings
+    return BatchingEmbeddings(embeddings)
+
+
+# Micro-batching de embeddings
+
+class BatchingEmbeddings(Embeddings):
+    """Agrupa embed_query concorrentes em uma única chamada embed_documents.
+
+    A primeira query abre uma janela de `window` segundos; tudo que chegar
+    nela (até `max_batch` textos) vai na mesma requisição e cada chamador
+    recebe o seu vetor por um Future. embed_documents passa direto.
+    """
+
+    def __init__(self, embeddings: Embeddings, window: float = None, max_batch: int = None, max_inflight: int = 4):
+        self.embeddings = embeddings
+        self.window = window if window is not None else settings.embedding_batch_window_ms / 1000
+        self.max_batch = max_batch or settings.embedding_batch_size
+        self.stats = {"queries": 0, "batches": 0}
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="embed")
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        if settings.enable_metrics:
+            from src.observability.metrics import get_metrics
+            get_metrics().set_embedding_batcher(self.window, self.max_batch)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.submit(text).result(timeout=call_timeout())
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.wait_for(asyncio.wrap_future(self.submit(text)), call_timeout())
+
+    def submit(self, text: str) -> Future:
+        """Enfileira um texto; o Future resolve com o vetor."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _ensure_worker(self):
+        # Também recria a thread em workers forked depois do primeiro uso
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._collect, name="embed-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            closes = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = closes - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._flush, batch)
+
+    def _flush(self, batch: List[tuple]):
+        # Queries repetidas na mesma janela viram um único texto
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        start = time.monotonic()
+        try:
+            vectors = dict(zip(texts, self.embeddings.embed_documents(texts)))
+        except Exception as e:
+            for _, future in batch:
+                self._resolve(future, error=e)
+            return
+
+        for text, future in batch:
+            self._resolve(future, vectors[text])
+        self.stats["queries"] += len(batch)
+        self.stats["batches"] += 1
+        if settings.enable_metrics:
+            from src.observability.metrics import get_metrics
+            get_metrics().record_embedding_batch(len(batch), time.monotonic() - start)
+
+    @staticmethod
+    def _resolve(future: Future, result=None, error: Exception = None):
+        # O chamador pode ter desistido (timeout do aembed_query cancela o Future)
+        if future.done():
+            return
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def get_stats(self) -> dict:
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "avg_batch_size": self.stats["queries"] / batches if batches else 0.0,
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch
+        }
+
+
+# Latência e circuit breaker
+
+class LatencyTracker:
+    """Janela deslizante de latências para o delay de hedging."""
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self.samples) < settings.llm_hedge_min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitBreaker:
+    """closed -> open após N falhas seguidas; half-open após reset_timeout."""
+
+    def __init__(self, failure_threshold: int = None, reset_timeout: float = None):
+        self.failure_threshold = failure_threshold or settings.circuit_failure_threshold
+        self.reset_timeout = reset_timeout or settings.circuit_reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    @contextmanager
+    def attempt(self):
+        """Uma chamada ao primário: yield True se o circuito permite.
+
+        A sonda do half-open é liberada em qualquer saída (deadline,
+        gerador fechado pelo consumidor), mesmo sem record_success/failure.
+        """
+        with self._lock:
+            state = self.state
+            probe = state == "half_open" and not self._probing
+            if probe:
+                self._probing = True
+        try:
+            yield state == "closed" or probe
+        finally:
+            if probe:
+                with self._lock:
+                    self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+# Modelo resiliente
+
+class ResilientChatModel(Runnable):
+    """Modelo de chat com hedging, circuit breaker e fallback (LCEL: `prompt | llm`).
+
+    Se o primário não responde até o p95 recente, dispara uma requisição
+    duplicada e usa a primeira resposta. Falhas e respostas lentas abrem o
+    circuito; com o circuito aberto as chamadas vão direto ao fallback.
+    """
+
+    # Primário + duplicata do hedge para cada requisição admitida
+    _executor = ThreadPoolExecutor(max_workers=2 * settings.admission_max_concurrency, thread_name_prefix="llm")
+    # Separado: chamadas abandonadas ao primário não atrasam o fallback
+    _fallback_executor = ThreadPoolExecutor(
+        max_workers=settings.admission_max_concurrency, thread_name_prefix="llm-fallback"
+    )
+
+    def __init__(self, primary, fallback=None, breaker: CircuitBreaker = None):
+        self.primary = primary
+        self.fallback = fallback
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.stats = {"primary": 0, "fallback": 0, "hedged": 0, "errors": 0}
+
+    # sync
+
+    def invoke(self, input: Any, config: Optional[dict] = None, **kwargs) -> Any:
+        with self.breaker.attempt() as allowed:
+            if allowed:
+                try:
+                    return self._call_primary(input, config, **kwargs)
+                except DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Modelo primário falhou: {e!r}")
+        return self._call_fallback(input, config, **kwargs)
+
+    def _call_primary(self, input, config, **kwargs):
+        # Hedge e timeout contam a partir do início da chamada, não da fila
+        # do executor: espera local não é lentidão do upstream
+        future, started = self._start(self.primary, input, config, kwargs)
+        if not started.wait(call_timeout()):
+            future.cancel()
+            raise TimeoutError("Sem thread livre para o modelo primário")
+        start = time.monotonic()
+        timeout = call_timeout()
+        end = start + timeout
+
+        futures = [future]
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is not None and hedge_delay < timeout:
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done:
+                self.stats["hedged"] += 1
+                futures.append(self._start(self.primary, input, config, kwargs, end=end)[0])
+
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, end - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    return self._primary_ok(future.result(), start)
+                error = future.exception()
+
+        if isinstance(error, DeadlineExceeded):
+            raise error
+        self._primary_failed()
+        raise error or TimeoutError(f"Modelo primário excedeu {timeout:.1f}s")
+
+    def _call_fallback(self, input, config, **kwargs):
+        if self.fallback is None:
+            self.stats["errors"] += 1
+            raise LLMUnavailableError("Modelo primário indisponível e sem fallback")
+        future, started = self._start(self.fallback, input, config, kwargs, executor=self._fallback_executor)
+        try:
+            if not started.wait(call_timeout()):
+                future.cancel()
+                raise TimeoutError("Sem thread livre para o fallback")
+            result = future.result(timeout=call_timeout())
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            self.stats["errors"] += 1
+            raise LLMUnavailableError(f"Fallback falhou: {e!r}") from e
+        self._record("fallback")
+        return result
+
+    def stream(self, input: Any, config: Optional[dict] = None, **kwargs):
+        """Streaming do primário, sem hedging; falha antes do primeiro token
+        cai no fallback, depois dele é propagada."""
+        with self.breaker.attempt() as allowed:
+            if allowed:
+                call = self._with_timeout(self.primary, kwargs, call_timeout())
+                start = time.monotonic()
+                started = False
+                try:
+                    for chunk in self.primary.stream(input, config, **call):
+                        started = True
+                        yield chunk
+                except Exception as e:
+                    self._primary_failed()
+                    if started:
+                        raise LLMUnavailableError(f"Streaming interrompido: {e!r}") from e
+                    logger.warning(f"Modelo primário falhou: {e!r}")
+                else:
+                    self._primary_ok(None, start)
+                    return
+
+        if self.fallback is None:
+            self.stats["errors"] += 1
+            raise LLMUnavailableError("Modelo primário indisponível e sem fallback")
+        call = self._with_timeout(self.fallback, kwargs, call_timeout())
+        yield from self.fallback.stream(input, config, **call)
+        self._record("fallback")
+
+    # async
+
+    async def ainvoke(self, input: Any, config: Optional[dict] = None, **kwargs) -> Any:
+        with self.breaker.attempt() as allowed:
+            if allowed:
+                try:
+                    return await self._acall_primary(input, config, **kwargs)
+                except DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Modelo primário falhou: {e!r}")
+        return await self._acall_fallback(input, config, **kwargs)
+
+    async def _acall_primary(self, input, config, **kwargs):
+        timeout = call_timeout()
+        start = time.monotonic()
+        call = self._with_timeout(self.primary, kwargs, timeout)
+        tasks = [asyncio.ensure_future(self.primary.ainvoke(input, config, **call))]
+        try:
+            hedge_delay = self._hedge_delay()
+            if hedge_delay is not None and hedge_delay < timeout:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done:
+                    self.stats["hedged"] += 1
+                    call = self._with_timeout(self.primary, kwargs, timeout - hedge_delay)
+                    tasks.append(asyncio.ensure_future(self.primary.ainvoke(input, config, **call)))
+
+            error = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, timeout - (time.monotonic() - start)),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        return self._primary_ok(task.result(), start)
+                    error = task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        self._primary_failed()
+        raise error or TimeoutError(f"Modelo primário excedeu {timeout:.1f}s")
+
+    async def _acall_fallback(self, input, config, **kwargs):
+        if self.fallback is None:
+            self.stats["errors"] += 1
+            raise LLMUnavailableError("Modelo primário indisponível e sem fallback")
+        try:
+            timeout = call_timeout()
+            call = self._with_timeout(self.fallback, kwargs, timeout)
+            result = await asyncio.wait_for(self.fallback.ainvoke(input, config, **call), timeout)
+        except Exception as e:
+            self.stats["errors"] += 1
+            raise LLMUnavailableError(f"Fallback falhou: {e!r}") from e
+        self._record("fallback")
+        return result
+
+    # comum
+
+    def _start(
+        self, model, input, config, kwargs: dict, executor: ThreadPoolExecutor = None, end: float = None
+    ) -> Tuple[Future, threading.Event]:
+        """Submete model.invoke; o evento marca quando a chamada sai da fila.
+
+        O timeout HTTP é calculado nesse momento (até `end`, se dado), na
+        cópia do contexto da thread chamadora (deadline atual).
+        """
+        started = threading.Event()
+
+        def run():
+            started.set()
+            timeout = call_timeout()
+            if end is not None:
+                timeout = min(timeout, end - time.monotonic())
+            return model.invoke(input, config, **self._with_timeout(model, kwargs, timeout))
+
+        future = (executor or self._executor).submit(contextvars.copy_context().run, run)
+        return future, started
+
+    @staticmethod
+    def _with_timeout(model, kwargs: dict, timeout: float) -> dict:
+        """Repassa o tempo restante como timeout da chamada HTTP (modelos OpenAI).
+
+        Sem isso uma chamada abandonada no deadline continua até llm_timeout
+        ocupando uma thread do executor.
+        """
+        if "request_timeout" in getattr(type(model), "model_fields", {}):
+            return {**kwargs, "timeout": max(0.001, timeout)}
+        return kwargs
+
+    def _hedge_delay(self) -> Optional[float]:
+        return self.latency.quantile(settings.llm_hedge_quantile)
+
+    def _primary_ok(self, result, start: float):
+        elapsed = time.monotonic() - start
+        self.latency.observe(elapsed)
+        if elapsed > settings.llm_slow_threshold:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        self._record("primary")
+        return result
+
+    def _primary_failed(self):
+        self.breaker.record_failure()
+        if settings.enable_metrics:
+            from src.observability.metrics import get_metrics
+            get_metrics().record_llm_call("primary", "error")
+
+    def _record(self, model: str):
+        self.stats[model] += 1
+        if settings.enable_metrics:
+            from src.observability.metrics import get_metrics
+            get_metrics().record_llm_call(model, "ok")
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "circuit": self.breaker.state}
+
+
+def build_resilient_llm(primary=None, fallback=None, breaker: CircuitBreaker = None) -> ResilientChatModel:
+    """Cria o modelo resiliente (primário = default_model, fallback = fallback_model)."""
+    if primary is None:
+        primary = build_chat_model(settings.default_model)
+    if fallback is None and settings.fallback_model:
+        fallback = build_chat_model(settings.fallback_model)
+    return ResilientChatModel(primary, fallback, breaker)
@@ -3,61 +3,123 @@ pipeline.py
 Pipeline RAG Enterprise completo.
 """
 
+import hashlib
+import json
 import time
 import logging
-from typing import List, Optional
-
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_chroma import Chroma
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document as LCDocument
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from rank_bm25 import BM25Okapi
-import re
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 from src.config import settings
-from src.models import QueryResponse, SearchResult, EvaluationResult
+from src.observability.metrics import get_metrics
+from src.observability.trace import request_trace, trace_count, trace_set, trace_stage
+from src.models import QueryResponse, SearchResult, EvaluationResult, RefinementResult, IngestReport
+from src.rag.lexical import BM25Index, tokenize
+from src.rag.router import AnswerCache, QueryRouter
+from src.rag.store import DocumentStore
 
 logger = logging.getLogger(__name__)
 
+RETRIEVAL_CACHE_SIZE = 256
+
 
 class RAGPipeline:
-    """Pipeline RAG Enterprise com todas as funcionalidades."""
+    """Pipeline RAG Enterprise com todas as funcionalidades.
+    
+    Clientes, splitter, prompts e shards são criados no primeiro uso:
+    as dependências pesadas (langchain, chromadb) só são importadas
+    quando necessárias.
+    """
     
     def __init__(self):
-        # Embeddings e LLM
-        self.embeddings = OpenAIEmbeddings(
-            model=settings.embedding_model,
-            api_key=settings.openai_api_key
-        )
-        self.llm = ChatOpenAI(
-            model=settings.default_model,
-            temperature=0.1,
-            api_key=settings.openai_api_key
-        )
+        # Componentes criados sob demanda
+        self._embeddings = None
+        self._llm = None
+        self._splitter = None
+        self._shards = None
+        self._prompts_ready = False
         
-        # Text splitter
-        self.splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
-        )
+        # Roteamento adaptativo
+        self.answer_cache = AnswerCache()
+        self.router = QueryRouter(self.answer_cache)
+        
+        # Cache de retrieval (reusado pelo refinamento)
+        self._retrieval_cache: "OrderedDict[tuple, List[SearchResult]]" = OrderedDict()
+        self._retrieval_lock = threading.Lock()
         
         # Stores
         self.vector_store = None
-        self.documents: List[str] = []
-        self.bm25 = None
+        self.documents: DocumentStore = DocumentStore()
+        self.bm25: Optional[BM25Index] = None
+        self._index_lock = threading.RLock()
         
-        # Prompts
-        self._init_prompts()
+        # Quase-duplicatas: chave canônica (doc_i ou doc_i:j) -> fontes colapsadas
+        self.duplicates: Dict[str, List[str]] = {}
+        self._dedup = None
         
         # Métricas
         self.total_queries = 0
         self.total_tokens = 0
     
+    @property
+    def embeddings(self):
+        """Embeddings OpenAI no pool HTTP compartilhado (lazy)."""
+        if self._embeddings is None:
+            from src.rag.llm import build_embeddings
+            self._embeddings = build_embeddings()
+        return self._embeddings
+    
+    @property
+    def llm(self):
+        """LLM de chat com hedging e fallback (lazy)."""
+        if self._llm is None:
+            from src.rag.llm import build_resilient_llm
+            self._llm = build_resilient_llm()
+        return self._llm
+    
+    @property
+    def splitter(self):
+        """Text splitter (lazy)."""
+        if self._splitter is None:
+            from langchain.text_splitter import RecursiveCharacterTextSplitter
+            self._splitter = RecursiveCharacterTextSplitter(
+                chunk_size=1000,
+                chunk_overlap=200
+            )
+        return self._splitter
+    
+    @property
+    def shards(self):
+        """Coordenador de shards, se SHARD_URLS estiver configurado (lazy)."""
+        if self._shards is None and settings.shard_urls:
+            from src.rag.distributed import ShardCoordinator
+            self._shards = ShardCoordinator.from_urls(
+                [u.strip() for u in settings.shard_urls.split(",") if u.strip()],
+                embeddings=self.embeddings,
+                splitter=self.splitter
+            )
+        return self._shards
+    
+    @property
+    def generate_prompt(self):
+        self._init_prompts()
+        return self._generate_prompt
+    
+    @property
+    def evaluate_prompt(self):
+        self._init_prompts()
+        return self._evaluate_prompt
+    
     def _init_prompts(self):
         """Inicializa prompts."""
-        self.generate_prompt = ChatPromptTemplate.from_messages([
+        if self._prompts_ready:
+            return
+        from langchain_core.prompts import ChatPromptTemplate
+        
+        self._generate_prompt = ChatPromptTemplate.from_messages([
             ("system", """Você é um assistente especializado.
 Responda baseando-se APENAS no contexto fornecido.
 Se não souber, diga que não encontrou a informação.
@@ -67,7 +129,7 @@ Contexto:
             ("user", "{question}")
         ])
         
-        self.evaluate_prompt = ChatPromptTemplate.from_template("""
+        self._evaluate_prompt = ChatPromptTemplate.from_template("""
 Avalie esta resposta.
 
 Contexto: {context}
@@ -76,68 +138,374 @@ Resposta: {answer}
 JSON (sem markdown):
 {{"support": "fully/partially/no", "utility": 1-5, "issues": []}}
 """)
+        self._prompts_ready = True
     
-    def add_documents(self, documents: List[str]):
-        """Adiciona documentos ao índice."""
-        self.documents = documents
+    def add_documents(self, documents: List[str], append: bool = False, commit: bool = True) -> IngestReport:
+        """Adiciona documentos ao índice.
+        
+        append=True acrescenta ao corpus em vez de substituí-lo; commit=False
+        adia a persistência para commit_index() (ingestão em lotes). Chunks
+        quase duplicados não são embedados: a fonte vai para o chunk canônico.
+        
+        Num corpus em disco o append roda sob o lock do diretório, depois de
+        incorporar o que outros workers gravaram nele.
+        """
+        with self._index_lock:
+            if append and self.documents.directory is not None:
+                with self.documents.writer() as changed_from:
+                    self._sync_index(changed_from)
+                    return self._add_documents(documents, append, commit)
+            return self._add_documents(documents, append, commit)
+    
+    def _add_documents(self, documents: List[str], append: bool, commit: bool) -> IngestReport:
+        self._invalidate_caches()
+        report = IngestReport(documents=len(documents))
+        if self.shards:
+            self.documents.extend(documents)
+            self.shards.add_documents(documents)
+            return report
+        
+        from langchain_chroma import Chroma
+        from langchain_core.documents import Document as LCDocument
+        
+        offset = len(self.documents) if append else 0
+        if not append:
+            self._dedup = None
+        dedup = self._dedup_index(seed=append) if settings.dedup_enabled else None
         
-        # Cria chunks
+        # Cria chunks (um por grupo de quase-duplicatas); as duplicatas só
+        # entram em self.duplicates depois que o vector store aceitar o lote
         all_docs = []
+        doc_spans = []
+        registered = []
+        collapsed = []
         for i, doc in enumerate(documents):
+            source = f"doc_{offset + i}"
+            canonical_docs = set()
+            unique = 0
             chunks = self.splitter.split_text(doc)
-            for chunk in chunks:
+            doc_spans.append(self._chunk_spans(doc, chunks))
+            for j, chunk in enumerate(chunks):
+                report.chunks += 1
+                chunk_id = f"{source}:{j}"
+                canonical = dedup.add(chunk_id, chunk) if dedup is not None else None
+                if canonical is not None:
+                    collapsed.append((canonical, source))
+                    canonical_docs.add(canonical.split(":")[0])
+                    report.duplicate_chunks += 1
+                    continue
+                registered.append(chunk_id)
+                unique += 1
                 all_docs.append(LCDocument(
                     page_content=chunk,
-                    metadata={"source": f"doc_{i}"}
+                    metadata={"source": source, "chunk_id": chunk_id}
                 ))
+            
+            # Documento inteiro repetido: fica fora do BM25
+            if not unique and len(canonical_docs) == 1 and source not in canonical_docs:
+                collapsed.append((canonical_docs.pop(), source))
+                report.duplicate_documents += 1
         
         # Vector store
-        self.vector_store = Chroma.from_documents(
-            all_docs,
-            self.embeddings,
-            collection_name=settings.collection_name,
-            persist_directory=settings.chroma_dir
+        try:
+            if append and self.vector_store is not None:
+                if all_docs:
+                    self.vector_store.add_documents(all_docs)
+            else:
+                self.vector_store = Chroma.from_documents(
+                    all_docs,
+                    self.embeddings,
+                    collection_name=settings.collection_name,
+                    persist_directory=settings.chroma_dir
+                )
+        except Exception:
+            # Lote não embedado: o retry não pode se ver como duplicata de si mesmo
+            if not append:
+                self._dedup = None  # refeito a partir do corpus atual
+            elif dedup is not None:
+                for chunk_id in registered:
+                    dedup.remove(chunk_id)
+            raise
+        
+        if not append:
+            self.duplicates = {}
+        for canonical, source in collapsed:
+            self._add_duplicate(canonical, source)
+        
+        # Corpus e índice léxico (incremental no append)
+        if not append:
+            self.documents = DocumentStore()
+        for doc, spans in zip(documents, doc_spans):
+            self.documents.add(doc, spans)
+        
+        skip = self._duplicate_documents()
+        if append and self.bm25 is not None:
+            self._index_lexical(self.bm25, documents, offset, skip)
+        else:
+            self.bm25 = self._index_lexical(BM25Index(), self.documents, skip=skip)
+        
+        if commit:
+            self.commit_index()
+        if settings.enable_metrics and report.duplicate_chunks:
+            get_metrics().record_dedup(report.duplicate_chunks, report.duplicate_documents)
+        logger.info(
+            f"Indexados {len(documents)} docs, {len(all_docs)} chunks "
+            f"({report.duplicate_chunks} duplicados, sem embedding)"
         )
+        return report
+    
+    def commit_index(self):
+        """Persiste o índice após uma sequência de appends."""
+        self._invalidate_caches()
+        self.save_index()
+    
+    def _index_lexical(self, index: BM25Index, documents: List[str], offset: int = 0, skip: Set[int] = frozenset()) -> BM25Index:
+        """Analisa e indexa documentos no BM25 (posição = índice no corpus).
         
-        # BM25
-        self.tokenized = [self._tokenize(d) for d in documents]
-        self.bm25 = BM25Okapi(self.tokenized)
+        Documentos em `skip` entram vazios para manter as posições.
+        """
+        for i, doc in enumerate(documents):
+            index.add(f"doc_{offset + i}", [] if offset + i in skip else self._tokenize(doc))
+        return index
+    
+    def _dedup_index(self, seed: bool = True):
+        """Índice de quase-duplicatas; após load_index é refeito a partir do corpus."""
+        if self._dedup is None:
+            from src.rag.dedup import NearDuplicateIndex
+            self._dedup = NearDuplicateIndex()
+            if seed:
+                self._seed_dedup(0)
+        return self._dedup
+    
+    def _seed_dedup(self, start: int):
+        """Registra no índice de quase-duplicatas os chunks de documents[start:]."""
+        skip = self._duplicate_documents()
+        for i in range(start, len(self.documents)):
+            if i in skip:
+                continue
+            chunks = self.documents.chunks(i) or self.splitter.split_text(self.documents[i])
+            for j, chunk in enumerate(chunks):
+                self._dedup.add(f"doc_{i}:{j}", chunk)
+    
+    def sync_index(self):
+        """Incorpora documentos que outros workers acrescentaram ao corpus em disco.
         
-        logger.info(f"Indexados {len(documents)} docs, {len(all_docs)} chunks")
+        Não espera: se este processo estiver indexando, fica para a próxima.
+        """
+        if not self._index_lock.acquire(blocking=False):
+            return
+        try:
+            self._sync_index(self.documents.refresh())
+        finally:
+            self._index_lock.release()
+    
+    def _sync_index(self, changed_from: int):
+        """Atualiza BM25, duplicatas e dedup a partir de documents[changed_from:]."""
+        if changed_from >= len(self.documents):
+            return
+        if changed_from == 0:
+            # Corpus substituído por outro worker: nada do estado local vale
+            self.duplicates = {}
+        self._merge_duplicates(self.documents.directory)
+        skip = self._duplicate_documents()
+        if changed_from and self.bm25 is not None:
+            self._index_lexical(self.bm25, self.documents[changed_from:], changed_from, skip)
+        else:
+            self.bm25 = self._index_lexical(BM25Index(), self.documents, skip=skip)
+        if changed_from == 0:
+            self._dedup = None
+        elif self._dedup is not None:
+            self._seed_dedup(changed_from)
+        self._invalidate_caches()
+        logger.info(f"Índice sincronizado: {len(self.documents) - changed_from} docs de outros workers")
+    
+    def _merge_duplicates(self, path: Path):
+        """Une às duplicatas locais as gravadas em disco por outros workers."""
+        duplicates_path = path / "duplicates.json"
+        if duplicates_path.exists():
+            for canonical, sources in json.loads(duplicates_path.read_text(encoding="utf-8")).items():
+                for source in sources:
+                    self._add_duplicate(canonical, source)
+    
+    @staticmethod
+    def _chunk_spans(doc: str, chunks: List[str]) -> List[Tuple[int, int]]:
+        """Posição (início, fim) de cada chunk no documento."""
+        spans = []
+        cursor = 0
+        for chunk in chunks:
+            start = doc.find(chunk, cursor)
+            if start < 0:
+                return []  # splitter alterou o texto: sem offsets
+            spans.append((start, start + len(chunk)))
+            cursor = start + 1
+        return spans
+    
+    def _add_duplicate(self, canonical: str, source: str):
+        sources = self.duplicates.setdefault(canonical, [])
+        if source not in sources and canonical.split(":")[0] != source:
+            sources.append(source)
+    
+    def _duplicate_documents(self) -> Set[int]:
+        """Posições dos documentos que são cópia integral de outro."""
+        return {
+            int(source[len("doc_"):])
+            for canonical, sources in self.duplicates.items() if ":" not in canonical
+            for source in sources
+        }
+    
+    def _result_metadata(self, key: str, source: str) -> dict:
+        """Fontes do resultado, incluindo as quase-duplicatas colapsadas nele."""
+        duplicates = self.duplicates.get(key)
+        return {"sources": [source] + duplicates} if duplicates else {}
+    
+    def save_index(self):
+        """Persiste o corpus (blob + offsets) e as duplicatas em disco.
+        
+        Se o corpus já está no diretório (append), as duplicatas gravadas
+        por outros workers são mescladas em vez de sobrescritas.
+        """
+        path = Path(settings.index_dir)
+        shared = self.documents.directory == path
+        self.documents.save(path)
+        with self._index_lock, self.documents.writer() as changed_from:
+            self._sync_index(changed_from)
+            if shared:
+                self._merge_duplicates(path)
+            tmp = path / "duplicates.json.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.duplicates, f)
+            os.replace(tmp, path / "duplicates.json")
+    
+    def load_index(self, vector_store: bool = True) -> bool:
+        """Carrega o índice persistido. Retorna False se não existir.
+        
+        O corpus é mapeado em memória (mmap), não copiado para o heap.
+        """
+        path = Path(settings.index_dir)
+        if not DocumentStore.exists(path):
+            return False
+        documents = DocumentStore.open(path)
+        
+        self._invalidate_caches()
+        self.documents = documents
+        duplicates_path = path / "duplicates.json"
+        self.duplicates = json.loads(duplicates_path.read_text(encoding="utf-8")) if duplicates_path.exists() else {}
+        self._dedup = None
+        self.bm25 = (
+            self._index_lexical(BM25Index(), self.documents, skip=self._duplicate_documents())
+            if self.documents else None
+        )
+        
+        if vector_store:
+            self.attach_vector_store()
+        
+        logger.info(f"Índice carregado: {len(self.documents)} docs")
+        return True
+    
+    def attach_vector_store(self):
+        """Abre a coleção Chroma persistida."""
+        from langchain_chroma import Chroma
+        
+        self.vector_store = Chroma(
+            collection_name=settings.collection_name,
+            embedding_function=self.embeddings,
+            persist_directory=settings.chroma_dir
+        )
+    
+    def _invalidate_caches(self):
+        """Descarta resultados em cache após mudança no índice."""
+        with self._retrieval_lock:
+            self._retrieval_cache.clear()
+        self.answer_cache.clear()
+    
+    @property
+    def is_ready(self) -> bool:
+        """Índices carregados e prontos para consulta."""
+        if self.shards:
+            return self.shards.n_docs > 0
+        return self.bm25 is not None and self.vector_store is not None
     
     def _tokenize(self, text: str) -> List[str]:
-        return re.findall(r'[\w-]+', text.lower())
+        return tokenize(text)
+    
+    def semantic_search(self, query: str, k: int = None) -> List[SearchResult]:
+        """Busca semântica no vector store."""
+        k = k or settings.retriever_k
+        if not self.vector_store:
+            return []
+        
+        with trace_stage("semantic", k=k) as stage:
+            sem_results = self.vector_store.similarity_search_with_score(query, k=k)
+            stage["candidates"] = len(sem_results)
+        return [
+            SearchResult(
+                content=doc.page_content,
+                score=1-score,
+                source=doc.metadata.get("source", ""),
+                metadata=self._result_metadata(doc.metadata.get("chunk_id", ""), doc.metadata.get("source", ""))
+            )
+            for doc, score in sem_results
+        ]
+    
+    def bm25_search(self, query: str, k: int = None) -> List[SearchResult]:
+        """Busca léxica BM25."""
+        k = k or settings.retriever_k
+        if not self.bm25:
+            return []
+        
+        with trace_stage("bm25", k=k) as stage:
+            ranked = self.bm25.rank(self._tokenize(query), k)
+            stage["candidates"] = len(ranked)
+        return [
+            SearchResult(
+                content=self.documents[i],
+                score=s,
+                source=f"doc_{i}",
+                metadata=self._result_metadata(f"doc_{i}", f"doc_{i}")
+            )
+            for i, s in ranked
+        ]
     
     def hybrid_search(self, query: str, k: int = None) -> List[SearchResult]:
         """Busca híbrida: semântico + BM25."""
         k = k or settings.retriever_k
         
-        # Semântico
-        if self.vector_store:
-            sem_results = self.vector_store.similarity_search_with_score(query, k=k)
-            semantic = [
-                SearchResult(content=doc.page_content, score=1-score, source=doc.metadata.get("source", ""))
-                for doc, score in sem_results
-            ]
-        else:
-            semantic = []
-        
-        # BM25
-        if self.bm25:
-            tokens = self._tokenize(query)
-            scores = self.bm25.get_scores(tokens)
-            ranked = sorted(enumerate(scores), key=lambda x: -x[1])[:k]
-            bm25_results = [
-                SearchResult(content=self.documents[i], score=s, source=f"doc_{i}")
-                for i, s in ranked if s > 0
-            ]
-        else:
-            bm25_results = []
+        if self.shards:
+            return self.shards.search(query, k)
         
         # RRF Fusion
-        return self._rrf_fusion([semantic, bm25_results], k)
+        return self._rrf_fusion([self.semantic_search(query, k), self.bm25_search(query, k)], k)
+    
+    def retrieve(self, query: str, k: int = None, strategy: str = "hybrid") -> List[SearchResult]:
+        """Busca com a estratégia escolhida pelo roteador (com cache)."""
+        k = k or settings.retriever_k
+        key = (query, k, strategy)
+        self.sync_index()
+        with self._retrieval_lock:
+            cached = self._retrieval_cache.get(key)
+            if cached is not None:
+                self._retrieval_cache.move_to_end(key)
+                trace_count("retrieval_cache_hit")
+                return list(cached)
+        trace_count("retrieval_cache_miss")
+        
+        with trace_stage("retrieve", strategy=strategy, k=k) as stage:
+            if strategy == "semantic" and not self.shards:
+                results = self.semantic_search(query, k)
+            elif strategy == "bm25" and not self.shards:
+                results = self.bm25_search(query, k)
+            else:
+                results = self.hybrid_search(query, k)
+            stage["candidates"] = len(results)
+        
+        with self._retrieval_lock:
+            self._retrieval_cache[key] = results
+            while len(self._retrieval_cache) > RETRIEVAL_CACHE_SIZE:
+                self._retrieval_cache.popitem(last=False)
+        return list(results)
     
-    def _rrf_fusion(self, rankings: List[List[SearchResult]], k: int) -> List[SearchResult]:
+    @staticmethod
+    def _rrf_fusion(rankings: List[List[SearchResult]], k: int) -> List[SearchResult]:
         """Reciprocal Rank Fusion."""
         scores = {}
         docs = {}
@@ -154,69 +522,309 @@ JSON (sem markdown):
         ranked = sorted(scores.items(), key=lambda x: -x[1])[:k]
         return [docs[key] for key, _ in ranked]
     
+    def _generate_chain(self, query: str, context: List[SearchResult]):
+        context_str = "\n\n---\n\n".join([r.content for r in context])
+        chain = self.generate_prompt | self.llm
+        return chain, {"question": query, "context": context_str}
+    
+    def _usage(self, message) -> int:
+        """Tokens consumidos por uma chamada ao LLM."""
+        usage = getattr(message, "usage_metadata", None) or {}
+        tokens = usage.get("total_tokens", 0)
+        self.total_tokens += tokens
+        trace_count("tokens", tokens)
+        return tokens
+    
+    def _generate(self, query: str, context: List[SearchResult], on_token: Callable[[str], None] = None) -> Tuple[str, int]:
+        from src.rag.llm import stage_deadline
+        
+        chain, inputs = self._generate_chain(query, context)
+        started = time.perf_counter()
+        with trace_stage("generate", context=len(context), streaming=on_token is not None) as stage, \
+                stage_deadline("generate"):
+            if on_token is None:
+                message = chain.invoke(inputs)
+            else:
+                message = None
+                for chunk in chain.stream(inputs):
+                    if message is None:
+                        stage["first_token_ms"] = round((time.perf_counter() - started) * 1000, 3)
+                    message = chunk if message is None else message + chunk
+                    if chunk.content:
+                        on_token(chunk.content)
+            stage["tokens"] = tokens = self._usage(message)
+        return message.content, tokens
+    
     def generate(self, query: str, context: List[SearchResult]) -> str:
         """Gera resposta."""
-        context_str = "\n\n---\n\n".join([r.content for r in context])
+        return self._generate(query, context)[0]
+    
+    async def agenerate(self, query: str, context: List[SearchResult]) -> str:
+        """Gera resposta (async)."""
+        chain, inputs = self._generate_chain(query, context)
+        message = await chain.ainvoke(inputs)
+        self._usage(message)
+        return message.content
+    
+    def _evaluate_chain(self, answer: str, context: List[SearchResult]):
+        context_str = "\n".join([r.content[:200] for r in context[:3]])
+        chain = self.evaluate_prompt | self.llm
+        return chain, {"context": context_str, "answer": answer}
+    
+    def _parse_evaluation(self, result: str) -> EvaluationResult:
+        data = json.loads(result.replace("```json", "").replace("```", ""))
+        
+        return EvaluationResult(
+            support_level=data.get("support", "partially"),
+            utility_score=data.get("utility", 3),
+            unsupported_claims=data.get("issues", []),
+            needs_refinement=data.get("support") == "no" or data.get("utility", 3) < settings.utility_threshold
+        )
+    
+    def _evaluate(self, answer: str, context: List[SearchResult]) -> Tuple[EvaluationResult, int]:
+        from src.rag.llm import stage_deadline
         
-        chain = self.generate_prompt | self.llm | StrOutputParser()
-        return chain.invoke({"question": query, "context": context_str})
+        tokens = 0
+        try:
+            chain, inputs = self._evaluate_chain(answer, context)
+            with trace_stage("evaluate") as stage, stage_deadline("evaluate"):
+                message = chain.invoke(inputs)
+                stage["tokens"] = tokens = self._usage(message)
+            return self._parse_evaluation(message.content), tokens
+        except Exception as e:
+            logger.error(f"Erro na avaliação: {e}")
+            return EvaluationResult(support_level="partially", utility_score=3), tokens
     
     def evaluate(self, answer: str, context: List[SearchResult]) -> EvaluationResult:
         """Avalia resposta."""
-        import json
-        context_str = "\n".join([r.content[:200] for r in context[:3]])
-        
+        return self._evaluate(answer, context)[0]
+    
+    async def aevaluate(self, answer: str, context: List[SearchResult]) -> EvaluationResult:
+        """Avalia resposta (async)."""
         try:
-            chain = self.evaluate_prompt | self.llm | StrOutputParser()
-            result = chain.invoke({"context": context_str, "answer": answer})
-            data = json.loads(result.replace("```json", "").replace("```", ""))
-            
-            return EvaluationResult(
-                support_level=data.get("support", "partially"),
-                utility_score=data.get("utility", 3),
-                unsupported_claims=data.get("issues", []),
-                needs_refinement=data.get("support") == "no" or data.get("utility", 3) < settings.utility_threshold
-            )
+            chain, inputs = self._evaluate_chain(answer, context)
+            message = await chain.ainvoke(inputs)
+            self._usage(message)
+            return self._parse_evaluation(message.content)
         except Exception as e:
             logger.error(f"Erro na avaliação: {e}")
             return EvaluationResult(support_level="partially", utility_score=3)
     
-    def process(self, question: str, k: int = None) -> QueryResponse:
-        """Processa uma pergunta."""
+    @staticmethod
+    def context_fingerprint(question: str, context: List[SearchResult]) -> str:
+        """Identifica um prompt (pergunta + conjunto de chunks) já enviado."""
+        digest = hashlib.sha1(question.encode("utf-8"))
+        for r in sorted(context, key=lambda r: r.content):
+            digest.update(b"\x00" + r.content.encode("utf-8"))
+        return digest.hexdigest()
+    
+    def refine(
+        self,
+        question: str,
+        context: List[SearchResult],
+        evaluation: EvaluationResult,
+        attempt: int,
+        strategy: str = "hybrid",
+        seen: Optional[Set[str]] = None
+    ) -> Optional[RefinementResult]:
+        """Uma tentativa de refinamento com contexto novo.
+        
+        Expande a query com as afirmações sem suporte, busca com k maior e
+        refunde com o contexto anterior, que pode crescer até retriever_k
+        (chunks de pior ranking saem). Retorna None se o prompt resultante
+        já foi enviado: nada mudou e não há trabalho novo a fazer.
+        """
+        from src.rag.llm import stage_deadline
+        
+        start = time.time()
+        seen = seen if seen is not None else set()
+        seen.add(self.context_fingerprint(question, context))
+        
+        size = len(context) or settings.rerank_k
+        with trace_stage("refine", attempt=attempt) as stage:
+            expanded = " ".join([question, *evaluation.unsupported_claims[:3]])
+            candidates = self.retrieve(expanded, size * (attempt + 1), strategy)
+            limit = max(size, min(size * 2, settings.retriever_k))
+            new_context = self._rrf_fusion([candidates, context], limit)
+            stage["candidates"] = len(candidates)
+            stage["context"] = len(new_context)
+            
+            fingerprint = self.context_fingerprint(question, new_context)
+            if fingerprint in seen:
+                stage["outcome"] = "unchanged"
+                self._record_refinement("unchanged")
+                return None
+            seen.add(fingerprint)
+            
+            with stage_deadline("refine"):
+                answer, gen_tokens = self._generate(question, new_context)
+                new_evaluation, eval_tokens = self._evaluate(answer, new_context)
+        
+        result = RefinementResult(
+            answer=answer,
+            context=new_context,
+            evaluation=new_evaluation,
+            improved=new_evaluation.utility_score >= evaluation.utility_score,
+            quality_gain=new_evaluation.utility_score - evaluation.utility_score,
+            tokens_used=gen_tokens + eval_tokens,
+            latency_ms=(time.time() - start) * 1000
+        )
+        stage["outcome"] = "improved" if result.quality_gain > 0 else "no_gain"
+        self._record_refinement(stage["outcome"], result)
+        return result
+    
+    def _record_refinement(self, outcome: str, result: Optional[RefinementResult] = None):
+        if settings.enable_metrics:
+            get_metrics().record_refinement(
+                outcome,
+                result.latency_ms / 1000 if result else 0.0,
+                result.tokens_used if result else 0,
+                result.quality_gain if result else 0
+            )
+    
+    def process(
+        self,
+        question: str,
+        k: int = None,
+        strategy: str = "auto",
+        on_token: Callable[[str], None] = None
+    ) -> QueryResponse:
+        """Processa uma pergunta dentro do orçamento de tempo (request_budget).
+        
+        Com `on_token`, a primeira resposta é gerada em streaming e cada
+        trecho é repassado ao callback; a resposta final pode ser a refinada.
+        Cada chamada é registrada num trace (ou no trace já aberto pela API).
+        """
+        from src.rag.llm import request_deadline
+        
+        with request_trace("query") as trace, request_deadline():
+            trace.set(question=question[:200])
+            return self._process(question, k, strategy, on_token)
+    
+    def _process(
+        self,
+        question: str,
+        k: int = None,
+        strategy: str = "auto",
+        on_token: Callable[[str], None] = None
+    ) -> QueryResponse:
+        from src.rag.llm import LLMUnavailableError
+        
         start = time.time()
         self.total_queries += 1
         
-        # 1. Busca híbrida
-        results = self.hybrid_search(question, k or settings.rerank_k)
+        # 0. Roteamento
+        with trace_stage("route") as stage:
+            decision = self.router.route(question, strategy)
+            stage["strategy"] = decision.strategy
+        if decision.strategy == "cache":
+            cached = self.answer_cache.get(question)
+            trace_count("answer_cache_hit" if cached is not None else "answer_cache_miss")
+            if cached is not None:
+                response = cached.model_copy(update={
+                    "latency_ms": (time.time() - start) * 1000,
+                    "tokens_used": 0,
+                    "strategy_used": "cache"
+                })
+                self._record_route(response)
+                trace_set(strategy="cache")
+                if on_token is not None:
+                    on_token(response.answer)
+                return response
+            decision.strategy = "hybrid"
+        
+        # 1. Busca
+        results = self.retrieve(question, k or settings.rerank_k, decision.strategy)
         
         # 2. Gera resposta
-        answer = self.generate(question, results)
+        answer, tokens = self._generate(question, results, on_token)
         
-        # 3. Avalia
-        evaluation = self.evaluate(answer, results)
+        # 3. Avalia (match exato de identificador dispensa o validador)
+        if self.router.is_exact_match(decision, results):
+            evaluation = EvaluationResult(support_level="fully", utility_score=5)
+            trace_count("validation_skipped")
+            if settings.enable_metrics:
+                get_metrics().record_skip("validation")
+        else:
+            evaluation, eval_tokens = self._evaluate(answer, results)
+            tokens += eval_tokens
         
-        # 4. Refina se necessário
+        # 4. Refina com contexto novo enquanto houver trabalho novo
         was_refined = False
-        if evaluation.needs_refinement and settings.max_refinements > 0:
-            # Simplified refinement
-            answer = self.generate(question, results)
-            was_refined = True
+        seen: Set[str] = set()
+        for attempt in range(1, settings.max_refinements + 1):
+            if not evaluation.needs_refinement:
+                break
+            try:
+                refinement = self.refine(question, results, evaluation, attempt, decision.strategy, seen)
+            except LLMUnavailableError as e:
+                # Sem orçamento ou LLM indisponível: fica com a melhor resposta
+                logger.warning(f"Refinamento interrompido: {e}")
+                break
+            if refinement is None:
+                break
+            tokens += refinement.tokens_used
+            if refinement.improved:
+                answer, results, evaluation = refinement.answer, refinement.context, refinement.evaluation
+                was_refined = True
         
         latency = (time.time() - start) * 1000
         
-        return QueryResponse(
+        response = QueryResponse(
             answer=answer,
             confidence=evaluation.utility_score / 5,
-            sources=[r.source for r in results[:3]],
+            sources=list(dict.fromkeys(
+                source for r in results[:3] for source in r.metadata.get("sources", [r.source])
+            )),
             latency_ms=latency,
-            strategy_used="hybrid",
+            tokens_used=tokens,
+            strategy_used=decision.strategy,
             was_refined=was_refined
         )
+        
+        if response.confidence >= settings.answer_cache_min_confidence:
+            self.answer_cache.put(question, response)
+        self._record_route(response)
+        trace_set(strategy=decision.strategy, was_refined=was_refined, confidence=response.confidence)
+        return response
+    
+    def _record_route(self, response: QueryResponse):
+        if settings.enable_metrics:
+            get_metrics().record_route_latency(response.strategy_used, response.latency_ms / 1000)
     
     def get_stats(self) -> dict:
         """Retorna estatísticas."""
-        return {
+        stats = {
             "total_queries": self.total_queries,
             "documents_indexed": len(self.documents),
+            "corpus_bytes": self.documents.nbytes,
             "vector_store_ready": self.vector_store is not None
         }
+        if self.shards:
+            stats["distributed"] = self.shards.get_stats()
+        if hasattr(self._embeddings, "get_stats"):
+            stats["embedding_batcher"] = self._embeddings.get_stats()
+        return stats
+
+
+# Pipeline compartilhado do processo (API, orquestrador, workers)
+_shared_pipeline: Optional[RAGPipeline] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_pipeline() -> RAGPipeline:
+    """Retorna o pipeline do processo, carregando o índice persistido."""
+    global _shared_pipeline
+    if _shared_pipeline is None:
+        with _shared_lock:
+            if _shared_pipeline is None:
+                pipeline = RAGPipeline()
+                pipeline.load_index()
+                _shared_pipeline = pipeline
+    return _shared_pipeline
+
+
+def set_shared_pipeline(pipeline: Optional[RAGPipeline]):
+    """Define o pipeline do processo (ex.: carregado pelo master pre-fork)."""
+    global _shared_pipeline
+    _shared_pipeline = pipeline
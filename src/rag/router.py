@@ -0,0 +1,119 @@
+"""
+router.py
+Roteamento adaptativo de queries (heurístico, sem chamada ao LLM).
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from src.config import settings
+from src.models import QueryResponse, RouteDecision, SearchResult
+from src.rag.lexical import IDENTIFIER_RE
+
+STRATEGIES = ("hybrid", "semantic", "bm25", "cache")
+
+CONCEPTUAL_RE = re.compile(
+    r'^(como|por que|porque|o que|qual a diferença|quais as diferenças|'
+    r'explique|descreva|compare|quando devo|vale a pena)\b'
+)
+
+
+def normalize_question(question: str) -> str:
+    """Chave canônica para o cache de respostas."""
+    return re.sub(r'\s+', ' ', question.lower()).strip(" ?!.")
+
+
+class AnswerCache:
+    """Cache LRU com TTL para respostas de perguntas frequentes."""
+
+    def __init__(self, max_size: int = None, ttl: float = None):
+        self.max_size = max_size or settings.answer_cache_size
+        self.ttl = ttl or settings.answer_cache_ttl
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, question: str) -> Optional[QueryResponse]:
+        key = normalize_question(question)
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires, response = item
+            if expires < time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return response
+
+    def put(self, question: str, response: QueryResponse):
+        key = normalize_question(question)
+        with self._lock:
+            self._items[key] = (time.time() + self.ttl, response)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __contains__(self, question: str) -> bool:
+        return self.get(question) is not None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class QueryRouter:
+    """Classificador local de queries.
+
+    - pergunta já respondida com alta confiança -> cache
+    - identificadores (CLI-2024-0892, NF-404)   -> bm25
+    - perguntas conceituais ou longas           -> semantic
+    - demais                                    -> hybrid
+    """
+
+    def __init__(self, cache: AnswerCache = None):
+        self.cache = cache if cache is not None else AnswerCache()
+
+    def route(self, question: str, strategy: str = "auto") -> RouteDecision:
+        """Decide a estratégia de retrieval."""
+        identifiers = IDENTIFIER_RE.findall(question)
+
+        if strategy and strategy != "auto":
+            if strategy not in STRATEGIES:
+                raise ValueError(f"Estratégia inválida: {strategy}")
+            decision = RouteDecision(strategy=strategy, reason="explicit", identifiers=identifiers)
+        elif question in self.cache:
+            decision = RouteDecision(strategy="cache", reason="faq")
+        elif identifiers:
+            decision = RouteDecision(strategy="bm25", reason="identifier", identifiers=identifiers)
+        elif self._is_conceptual(question):
+            decision = RouteDecision(strategy="semantic", reason="conceptual")
+        else:
+            decision = RouteDecision(strategy="hybrid", reason="default")
+
+        if settings.enable_metrics:
+            from src.observability.metrics import get_metrics
+            get_metrics().record_route(decision.strategy, decision.reason)
+        return decision
+
+    @staticmethod
+    def _is_conceptual(question: str) -> bool:
+        normalized = normalize_question(question)
+        return bool(CONCEPTUAL_RE.match(normalized)) or len(normalized.split()) >= 12
+
+    @staticmethod
+    def is_exact_match(decision: RouteDecision, results: List[SearchResult]) -> bool:
+        """Todos os identificadores da query aparecem inteiros no primeiro resultado.
+
+        NF-40 não casa com NF-404: compara com os identificadores extraídos
+        do texto, não por substring.
+        """
+        if not decision.identifiers or not results:
+            return False
+        found = {ident.lower() for ident in IDENTIFIER_RE.findall(results[0].content)}
+        return all(ident.lower() in found for ident in decision.identifiers)
@@ -0,0 +1,324 @@
+"""
+store.py
+Armazenamento de documentos: blob UTF-8 append-only mapeado em memória
+e um log append-only de offsets por documento e por chunk.
+"""
+
+import mmap
+import os
+import threading
+from array import array
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: só o lock entre threads
+    fcntl = None
+
+BLOB_FILE = "documents.bin"
+INDEX_FILE = "documents.idx"
+LOCK_FILE = "documents.lock"
+
+# Cabeçalho do log de offsets (versão do formato)
+INDEX_MAGIC = b"RAGIDX02"
+
+
+@contextmanager
+def _dir_lock(directory: Path):
+    """Lock exclusivo entre processos sobre o diretório do store.
+
+    Abre o arquivo a cada uso: workers criados por fork não compartilham
+    a descrição de arquivo (e portanto o flock) do processo pai.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(directory / LOCK_FILE, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class DocumentStore(Sequence[str]):
+    """Corpus como sequência de textos, decodificados só quando lidos.
+
+    Em memória usa um bytearray; depois de `save()` (ou `open()`) o blob
+    fica em disco e é lido por mmap, compartilhando o page cache entre os
+    workers. Cada documento é um registro no log de offsets com seu
+    intervalo de bytes e os intervalos dos seus chunks.
+
+    Vários processos podem acrescentar ao mesmo diretório: cada escrita
+    roda sob flock, grava no fim real do blob e acrescenta o registro ao
+    log. `refresh()` lê os registros gravados por outros processos.
+    """
+
+    def __init__(self, texts: Iterable[str] = ()):
+        self.directory: Optional[Path] = None
+        self._buffer = bytearray()
+        self._map = None
+        self._map_size = 0
+        self._lock = threading.RLock()
+        self._locked = False
+        self._idx_ino = None
+        self._idx_pos = 0
+        self.nbytes = 0
+
+        self.starts = array("Q")
+        self.ends = array("Q")
+        self.first_chunk = array("Q")
+        self.chunk_ranges = array("Q")  # início, fim (pares)
+        self.extend(texts)
+
+    # Leitura
+
+    def __len__(self) -> int:
+        return len(self.ends)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("documento inexistente")
+        return self._read(self.starts[index], self.ends[index])
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def chunk_range(self, doc: int, position: int) -> Optional[Tuple[int, int]]:
+        """Intervalo de bytes do chunk `position` do documento `doc`."""
+        if not 0 <= doc < len(self):
+            return None
+        row = self.first_chunk[doc] + position
+        last = self.first_chunk[doc + 1] if doc + 1 < len(self) else len(self.chunk_ranges) // 2
+        if position < 0 or row >= last:
+            return None
+        return self.chunk_ranges[2 * row], self.chunk_ranges[2 * row + 1]
+
+    def chunks(self, doc: int) -> List[str]:
+        """Textos dos chunks registrados para o documento."""
+        texts = []
+        while True:
+            span = self.chunk_range(doc, len(texts))
+            if span is None:
+                return texts
+            texts.append(self._read(*span))
+
+    def _read(self, start: int, end: int) -> str:
+        if self.directory is None:
+            return self._buffer[start:end].decode("utf-8")
+        if end > self._map_size:
+            with self._lock:
+                if end > self._map_size:
+                    self._remap()
+        return self._map[start:end].decode("utf-8")
+
+    # Escrita (append-only)
+
+    def add(self, text: str, spans: Sequence[Tuple[int, int]] = ()) -> int:
+        """Acrescenta um documento e os chunks dados como (início, fim) em caracteres."""
+        data = text.encode("utf-8")
+        spans = list(_byte_spans(text, spans))
+        if self.directory is None:
+            with self._lock:
+                base = len(self._buffer)
+                self._buffer += data
+                return self._append(base, base + len(data), [(base + s, base + e) for s, e in spans])
+
+        with self.writer():
+            with open(self.directory / BLOB_FILE, "ab") as f:
+                # Fim real do arquivo: outro processo pode ter escrito antes
+                base = os.fstat(f.fileno()).st_size
+                f.write(data)
+            spans = [(base + s, base + e) for s, e in spans]
+            record = _record(base, base + len(data), spans)
+            with open(self.directory / INDEX_FILE, "ab") as f:
+                f.write(record.tobytes())
+            self._idx_pos += record.itemsize * len(record)
+            return self._append(base, base + len(data), spans)
+
+    def extend(self, texts: Iterable[str]):
+        for text in texts:
+            self.add(text)
+
+    @contextmanager
+    def writer(self):
+        """Escrita exclusiva no diretório (reentrante).
+
+        Antes de liberar o bloco lê o que outros processos acrescentaram e
+        retorna (yield) a posição do primeiro documento novo ou alterado,
+        como `refresh()`.
+        """
+        with self._lock:
+            if self._locked or self.directory is None:
+                yield len(self)
+                return
+            with _dir_lock(self.directory):
+                self._locked = True
+                try:
+                    yield self._refresh_locked(repair=True)
+                finally:
+                    self._locked = False
+
+    def refresh(self, blocking: bool = True) -> int:
+        """Incorpora documentos gravados por outros processos.
+
+        Retorna a posição do primeiro documento novo (len(self) se nada
+        mudou, 0 se o índice foi substituído e relido do zero). Com
+        blocking=False não espera uma escrita local em andamento.
+        """
+        if self.directory is None:
+            return len(self)
+        if not self._lock.acquire(blocking=blocking):
+            return len(self)
+        try:
+            return self._refresh_locked()
+        finally:
+            self._lock.release()
+
+    def _refresh_locked(self, repair: bool = False) -> int:
+        path = self.directory / INDEX_FILE
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return len(self)
+
+        first = len(self)
+        if stat.st_ino != self._idx_ino:
+            # Índice substituído (save de um corpus novo): relê do zero
+            self._reset()
+            self._idx_ino = stat.st_ino
+            first = 0
+        elif stat.st_size == self._idx_pos:
+            return first
+
+        with open(path, "rb") as f:
+            f.seek(self._idx_pos)
+            data = f.read()
+        if self._idx_pos == 0:
+            if not data.startswith(INDEX_MAGIC):
+                raise ValueError(f"{path} não é um log de offsets")
+            data = data[len(INDEX_MAGIC):]
+            self._idx_pos = len(INDEX_MAGIC)
+        self._idx_pos += self._load_records(data)
+
+        if repair and os.path.getsize(path) > self._idx_pos:
+            # Registro incompleto de uma escrita interrompida: só quem tem o lock corta
+            os.truncate(path, self._idx_pos)
+        return first
+
+    def _load_records(self, data: bytes) -> int:
+        """Carrega registros completos; retorna os bytes consumidos."""
+        values = array("Q")
+        values.frombytes(data[:len(data) - len(data) % values.itemsize])
+        pos = 0
+        while pos + 3 <= len(values):
+            start, end, n_chunks = values[pos:pos + 3]
+            if pos + 3 + 2 * n_chunks > len(values):
+                break
+            ranges = values[pos + 3:pos + 3 + 2 * n_chunks]
+            self._append(start, end, zip(ranges[::2], ranges[1::2]))
+            pos += 3 + 2 * n_chunks
+        return pos * values.itemsize
+
+    def _append(self, start: int, end: int, spans: Iterable[Tuple[int, int]]) -> int:
+        self.first_chunk.append(len(self.chunk_ranges) // 2)
+        for chunk_start, chunk_end in spans:
+            self.chunk_ranges.extend((chunk_start, chunk_end))
+        self.starts.append(start)
+        self.ends.append(end)
+        self.nbytes += end - start
+        return len(self.ends) - 1
+
+    def _reset(self):
+        for values in (self.starts, self.ends, self.first_chunk, self.chunk_ranges):
+            del values[:]
+        self.nbytes = 0
+        self._idx_pos = 0
+        self._map = None
+        self._map_size = 0
+
+    # Persistência
+
+    def save(self, directory):
+        """Grava blob e log de offsets; o blob passa a ser lido por mmap.
+
+        No próprio diretório não há o que fazer: cada add já foi gravado.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            if self.directory == directory:
+                return
+            if self.directory is None:
+                blob = bytes(self._buffer)
+            else:
+                self._remap()
+                blob = self._map[:self._map_size]
+
+            index = self._index_bytes()
+            with _dir_lock(directory):
+                _write_atomic(directory / BLOB_FILE, blob)
+                _write_atomic(directory / INDEX_FILE, index)
+                self._idx_ino = os.stat(directory / INDEX_FILE).st_ino
+                self._idx_pos = len(index)
+            self.directory = directory
+            self._buffer = bytearray()
+            self._map = None
+            self._map_size = 0
+
+    @classmethod
+    def open(cls, directory) -> "DocumentStore":
+        """Abre um store gravado."""
+        store = cls()
+        store.directory = Path(directory)
+        store.refresh()
+        return store
+
+    @staticmethod
+    def exists(directory) -> bool:
+        return (Path(directory) / INDEX_FILE).exists()
+
+    def _index_bytes(self) -> bytes:
+        records = array("Q")
+        for i in range(len(self)):
+            last = self.first_chunk[i + 1] if i + 1 < len(self) else len(self.chunk_ranges) // 2
+            ranges = self.chunk_ranges[2 * self.first_chunk[i]:2 * last]
+            records.extend(_record(self.starts[i], self.ends[i], zip(ranges[::2], ranges[1::2])))
+        return INDEX_MAGIC + records.tobytes()
+
+    def _remap(self):
+        path = self.directory / BLOB_FILE
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            # Mapas antigos continuam válidos para quem ainda os referencia
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._map_size = size
+
+
+def _record(start: int, end: int, spans: Iterable[Tuple[int, int]]) -> array:
+    """Registro do log: início, fim, nº de chunks e os intervalos dos chunks."""
+    ranges = [value for span in spans for value in span]
+    return array("Q", [start, end, len(ranges) // 2, *ranges])
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    tmp.replace(path)
+
+
+def _byte_spans(text: str, spans: Sequence[Tuple[int, int]]) -> Iterator[Tuple[int, int]]:
+    """Converte intervalos em caracteres (crescentes) para bytes UTF-8."""
+    char_pos = byte_pos = 0
+    for start, end in spans:
+        byte_pos += len(text[char_pos:start].encode("utf-8"))
+        char_pos = start
+        yield byte_pos, byte_pos + len(text[start:end].encode("utf-8"))
@@ -0,0 +1,158 @@
+"""test_distributed.py - Testes do retrieval distribuído."""
+
+import hashlib
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+DOCS = [
+    "Política de férias: 30 dias após 12 meses de empresa.",
+    "Home office permitido até 3 dias por semana.",
+    "Código CLI-2024-0892: Empresa Alpha, contrato ativo.",
+    "Erro NF-404: nota fiscal não encontrada no sistema.",
+    "Férias podem ser divididas em até 3 períodos.",
+]
+
+
+class HashEmbeddings:
+    """Embeddings determinísticos (bag-of-words com hash)."""
+
+    def embed_query(self, text):
+        from src.rag.lexical import tokenize
+        vector = [0.0] * 64
+        for token in tokenize(text):
+            vector[int(hashlib.md5(token.encode()).hexdigest(), 16) % 64] += 1.0
+        return vector
+
+    def embed_documents(self, texts):
+        return [self.embed_query(t) for t in texts]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def shard_urls():
+    import httpx
+
+    procs, urls = [], []
+    for shard_id in range(2):
+        port = _free_port()
+        procs.append(subprocess.Popen(
+            [sys.executable, "-m", "src.rag.distributed", "--port", str(port), "--shard-id", str(shard_id)],
+            cwd=ROOT
+        ))
+        urls.append(f"http://127.0.0.1:{port}")
+
+    deadline = time.time() + 30
+    for url in urls:
+        while True:
+            try:
+                httpx.get(f"{url}/health", timeout=0.5).raise_for_status()
+                break
+            except Exception:
+                if time.time() > deadline:
+                    pytest.fail(f"Shard {url} não iniciou")
+                time.sleep(0.1)
+
+    yield urls
+
+    for proc in procs:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+class TestLexical:
+    def test_global_idf_matches_single_index(self):
+        from src.rag.distributed import LocalShardClient, ShardCoordinator, ShardWorker
+
+        single = ShardCoordinator([LocalShardClient(ShardWorker(0))])
+        sharded = ShardCoordinator([LocalShardClient(ShardWorker(i)) for i in range(3)])
+        single.add_documents(DOCS)
+        sharded.add_documents(DOCS)
+
+        a = {r.metadata["chunk_id"]: r.score for r in single.search("férias", 5)}
+        b = {r.metadata["chunk_id"]: r.score for r in sharded.search("férias", 5)}
+        assert a == b
+        assert set(a) == {"doc_0:0", "doc_4:0"}
+
+
+class TestShardCoordinator:
+    def test_subprocess_shards(self, shard_urls):
+        from src.rag.distributed import ShardCoordinator
+
+        coordinator = ShardCoordinator.from_urls(shard_urls, embeddings=HashEmbeddings(), timeout=5)
+        coordinator.add_documents(DOCS)
+
+        assert coordinator.n_docs == len(DOCS)
+        results = coordinator.search("CLI-2024-0892", k=3)
+        assert results[0].source == "doc_2"
+        assert coordinator.partial_searches == 0
+
+        # Id repetido volta como erro (409) em vez de ser ignorado
+        coordinator.n_documents = 0
+        with pytest.raises(ValueError):
+            coordinator.add_documents(DOCS[:1])
+        assert coordinator.n_documents == len(DOCS)
+
+    def test_partial_results_on_dead_shard(self, shard_urls):
+        from src.rag.distributed import HTTPShardClient, LocalShardClient, ShardCoordinator, ShardWorker
+
+        worker = ShardWorker(0)
+        worker.add([{"id": "doc_0:0", "content": DOCS[3], "source": "doc_0"}])
+        dead = HTTPShardClient(f"http://127.0.0.1:{_free_port()}", timeout=0.5)
+
+        coordinator = ShardCoordinator([LocalShardClient(worker), dead])
+        coordinator.refresh_stats()
+        results = coordinator.search("NF-404")
+
+        assert [r.source for r in results] == ["doc_0"]
+        assert coordinator.partial_searches > 0
+
+    def test_concurrent_searches(self, monkeypatch):
+        from concurrent.futures import ThreadPoolExecutor
+        from src.config import settings
+        from src.rag.distributed import LocalShardClient, ShardCoordinator, ShardWorker
+        monkeypatch.setattr(settings, "shard_timeout", 1.0)  # menor que a fila de 10 buscas
+
+        class SlowShard(LocalShardClient):
+            def search(self, *args, **kwargs):
+                time.sleep(0.2)
+                return super().search(*args, **kwargs)
+
+        workers = [ShardWorker(i) for i in range(2)]
+        coordinator = ShardCoordinator([SlowShard(w) for w in workers])
+        coordinator.add_documents(DOCS)
+        with ThreadPoolExecutor(10) as pool:
+            results = list(pool.map(lambda _: coordinator.search("férias", 3), range(10)))
+
+        assert all(r and r[0].source in ("doc_0", "doc_4") for r in results)
+        assert coordinator.partial_searches == 0
+
+    def test_resumes_from_populated_shards(self):
+        from src.rag.distributed import LocalShardClient, ShardCoordinator, ShardWorker
+
+        workers = [ShardWorker(i) for i in range(2)]
+        ShardCoordinator([LocalShardClient(w) for w in workers]).add_documents(DOCS)
+
+        coordinator = ShardCoordinator([LocalShardClient(w) for w in workers])
+        assert coordinator.n_docs == len(DOCS) and coordinator.n_documents == len(DOCS)
+        coordinator.add_documents(["Reembolso de despesas em até 5 dias úteis."])
+        assert coordinator.search("reembolso", 1)[0].source == f"doc_{len(DOCS)}"
+
+        with pytest.raises(ValueError):
+            workers[0].add([{"id": next(iter(workers[0].chunks)), "content": "outro"}])
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
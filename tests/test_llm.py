@@ -0,0 +1,281 @@
+"""test_llm.py - Testes da camada de clientes LLM contra um servidor OpenAI falso."""
+
+import asyncio
+import json
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+class FakeOpenAI:
+    """Servidor compatível com /v1/chat/completions que injeta latência e erros.
+
+    `plan[model]` é uma lista de (delay_s, status) consumida a cada chamada;
+    quando esgota, responde na hora com 200.
+    """
+
+    def __init__(self):
+        from fastapi import FastAPI, Request
+        from fastapi.responses import JSONResponse, StreamingResponse
+
+        self.plan = {}
+        self.calls = {}
+        app = FastAPI()
+
+        @app.post("/v1/chat/completions")
+        async def completions(request: Request):
+            body = await request.json()
+            model = body["model"]
+            self.calls[model] = self.calls.get(model, 0) + 1
+            steps = self.plan.get(model) or []
+            delay, status = steps.pop(0) if steps else (0.0, 200)
+            await asyncio.sleep(delay)
+            if status != 200:
+                return JSONResponse({"error": {"message": "injected", "type": "server_error"}}, status_code=status)
+            if body.get("stream"):
+                return StreamingResponse(self._sse(model), media_type="text/event-stream")
+            return {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": 0, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": model}}],
+                "usage": {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4}
+            }
+
+        self.app = app
+
+    @staticmethod
+    def _sse(model: str):
+        for piece in (model[:3], model[3:]):
+            chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": 0, "model": model,
+                     "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    def __enter__(self):
+        import uvicorn
+
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(self.app, port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/v1"
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    from src.config import settings
+    with FakeOpenAI() as server:
+        monkeypatch.setattr(settings, "openai_base_url", server.base_url)
+        monkeypatch.setattr(settings, "openai_api_key", "sk-fake")
+        monkeypatch.setattr(settings, "default_model", "primary")
+        monkeypatch.setattr(settings, "fallback_model", "fallback")
+        yield server
+
+
+class TestResilientLLM:
+    def test_shared_pool(self, fake_openai):
+        from src.rag.llm import build_resilient_llm, get_http_client
+        llm = build_resilient_llm()
+        assert llm.invoke("oi").content == "primary"
+        assert llm.primary.http_client is get_http_client()
+        assert llm.fallback.http_client is get_http_client()
+
+    def test_hedged_request(self, fake_openai, monkeypatch):
+        from src.config import settings
+        from src.rag.llm import build_resilient_llm
+        monkeypatch.setattr(settings, "llm_hedge_min_samples", 1)
+
+        llm = build_resilient_llm()
+        llm.latency.observe(0.05)
+        fake_openai.plan["primary"] = [(2.0, 200)]
+
+        start = time.monotonic()
+        assert llm.invoke("oi").content == "primary"
+        assert time.monotonic() - start < 1.0
+        assert llm.stats["hedged"] == 1
+        assert fake_openai.calls["primary"] == 2
+
+    def test_async_hedged_request(self, fake_openai, monkeypatch):
+        from src.config import settings
+        from src.rag.llm import build_resilient_llm
+        monkeypatch.setattr(settings, "llm_hedge_min_samples", 1)
+
+        llm = build_resilient_llm()
+        llm.latency.observe(0.05)
+        fake_openai.plan["primary"] = [(2.0, 200)]
+
+        start = time.monotonic()
+        assert asyncio.run(llm.ainvoke("oi")).content == "primary"
+        assert time.monotonic() - start < 1.0
+        assert llm.stats["hedged"] == 1
+
+    def test_queue_wait_is_not_upstream_latency(self, fake_openai, monkeypatch):
+        from concurrent.futures import ThreadPoolExecutor
+        from src.config import settings
+        from src.rag.llm import build_resilient_llm
+        monkeypatch.setattr(settings, "llm_timeout", 0.5)
+
+        llm = build_resilient_llm()
+        monkeypatch.setattr(llm, "_executor", ThreadPoolExecutor(max_workers=1))
+        llm._executor.submit(time.sleep, 0.3)  # thread ocupada por outra requisição
+        fake_openai.plan["primary"] = [(0.3, 200)]
+
+        assert llm.invoke("oi").content == "primary"
+        assert llm.breaker.failures == 0 and llm.stats["fallback"] == 0
+
+    def test_circuit_breaker_fallback(self, fake_openai):
+        from src.rag.llm import CircuitBreaker, build_resilient_llm
+        llm = build_resilient_llm(breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+        fake_openai.plan["primary"] = [(0.0, 500)] * 5
+
+        assert [llm.invoke("oi").content for _ in range(3)] == ["fallback"] * 3
+        assert fake_openai.calls["primary"] == 2
+        assert llm.breaker.state == "open"
+
+    def test_timeout_falls_back(self, fake_openai, monkeypatch):
+        from src.config import settings
+        from src.rag.llm import build_resilient_llm
+        monkeypatch.setattr(settings, "llm_timeout", 0.3)
+        fake_openai.plan["primary"] = [(2.0, 200)]
+
+        assert build_resilient_llm().invoke("oi").content == "fallback"
+
+    def test_stream_falls_back_before_first_token(self, fake_openai):
+        from src.rag.llm import build_resilient_llm
+        llm = build_resilient_llm()
+        assert [c.content for c in llm.stream("oi")] == ["pri", "mary"]
+
+        fake_openai.plan["primary"] = [(0.0, 500)]
+        assert "".join(c.content for c in llm.stream("oi")) == "fallback"
+        assert llm.stats["fallback"] == 1
+
+    def test_probe_released_on_deadline_and_close(self, fake_openai):
+        from src.rag.llm import CircuitBreaker, DeadlineExceeded, build_resilient_llm, request_deadline
+        llm = build_resilient_llm(breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.05))
+
+        llm.breaker.record_failure()
+        time.sleep(0.06)
+        with request_deadline(0.001):
+            time.sleep(0.01)
+            with pytest.raises(DeadlineExceeded):
+                llm.invoke("oi")
+        assert llm.invoke("oi").content == "primary"
+
+        llm.breaker.record_failure()
+        time.sleep(0.06)
+        stream = llm.stream("oi")
+        next(stream)
+        stream.close()
+        assert llm.invoke("oi").content == "primary"
+        assert llm.breaker.state == "closed"
+
+    def test_abandoned_call_stops_at_deadline(self, fake_openai, monkeypatch):
+        from concurrent.futures import wait
+        from src.rag.llm import LLMUnavailableError, build_resilient_llm, request_deadline
+        llm = build_resilient_llm()
+        fake_openai.plan["primary"] = [(3.0, 200)]
+
+        calls = []
+        start = llm._start
+        monkeypatch.setattr(llm, "_start", lambda *a, **kw: calls.append(start(*a, **kw)) or calls[-1])
+        with request_deadline(0.3):
+            with pytest.raises(LLMUnavailableError):
+                llm.invoke("oi")
+        # O timeout da chamada HTTP segue o orçamento, não llm_timeout
+        future, _ = calls[0]
+        wait([future], timeout=1.0)
+        assert future.done()
+
+    def test_deadline_exceeded(self):
+        from src.rag.llm import DeadlineExceeded, call_timeout, request_deadline, stage_deadline
+        with request_deadline(10.0):
+            with stage_deadline("evaluate"):
+                assert call_timeout() <= 3.0
+        with request_deadline(0.001):
+            time.sleep(0.01)
+            with pytest.raises(DeadlineExceeded):
+                call_timeout()
+
+
+class CountingEmbeddings:
+    """Embeddings falsos que contam chamadas (vetor = [len(texto)])."""
+
+    def __init__(self, fail: bool = False, delay: float = 0.0):
+        self.calls = []
+        self.fail = fail
+        self.delay = delay
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("embedding indisponível")
+        return [[float(len(t))] for t in texts]
+
+
+class TestBatchingEmbeddings:
+    def test_concurrent_queries_share_call(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from src.rag.llm import BatchingEmbeddings
+
+        inner = CountingEmbeddings()
+        embeddings = BatchingEmbeddings(inner, window=0.05, max_batch=64)
+        texts = ["q" * (i + 1) for i in range(20)]
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            vectors = list(pool.map(embeddings.embed_query, texts))
+
+        assert vectors == [[float(len(t))] for t in texts]
+        assert len(inner.calls) < 5
+        assert embeddings.get_stats()["queries"] == 20
+
+    def test_max_batch_and_async(self):
+        from src.rag.llm import BatchingEmbeddings
+
+        inner = CountingEmbeddings()
+        embeddings = BatchingEmbeddings(inner, window=0.2, max_batch=4)
+
+        async def run():
+            return await asyncio.gather(*[embeddings.aembed_query(f"q{i}") for i in range(8)])
+
+        start = time.monotonic()
+        assert len(asyncio.run(run())) == 8
+        assert time.monotonic() - start < 0.2
+        assert all(len(batch) <= 4 for batch in inner.calls)
+
+    def test_error_reaches_every_caller(self):
+        from src.rag.llm import BatchingEmbeddings
+
+        embeddings = BatchingEmbeddings(CountingEmbeddings(fail=True), window=0.01)
+        with pytest.raises(RuntimeError):
+            embeddings.embed_query("oi")
+
+    def test_cancelled_caller_does_not_block_batch(self):
+        from src.rag.llm import BatchingEmbeddings
+
+        embeddings = BatchingEmbeddings(CountingEmbeddings(fail=True, delay=0.2), window=0.05)
+        first, second = embeddings.submit("a"), embeddings.submit("b")
+        first.cancel()  # como o timeout do aembed_query
+        with pytest.raises(RuntimeError):
+            second.result(timeout=2)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -39,6 +39,331 @@ class TestRAGPipeline:
         tokens = pipeline._tokenize("Hello World!")
         assert "hello" in tokens
         assert "world" in tokens
+    
+    def test_index_roundtrip(self, tmp_path, monkeypatch):
+        from src.config import settings
+        from src.rag.pipeline import RAGPipeline
+        from src.rag.store import DocumentStore
+        monkeypatch.setattr(settings, "index_dir", str(tmp_path))
+        monkeypatch.setattr(settings, "openai_api_key", "sk-test")  # clientes não fazem chamadas
+        
+        pipeline = RAGPipeline()
+        pipeline.documents = DocumentStore(["Política de férias", "Home office"])
+        pipeline.save_index()
+        
+        loaded = RAGPipeline()
+        assert loaded.load_index(vector_store=False)
+        assert list(loaded.documents) == ["Política de férias", "Home office"]
+        assert loaded.bm25 is not None
+        assert not loaded.is_ready
+
+
+class TestDocumentStore:
+    def test_mmap_append_and_chunks(self, tmp_path):
+        from src.rag.store import DocumentStore
+        store = DocumentStore()
+        store.add("Política de férias: 30 dias.", [(0, 18), (12, 28)])
+        store.save(tmp_path)
+        store.add("Ação de home office")
+        store.save(tmp_path)
+        
+        opened = DocumentStore.open(tmp_path)
+        assert list(opened) == ["Política de férias: 30 dias.", "Ação de home office"]
+        assert opened.chunks(0) == ["Política de férias", "férias: 30 dias."]
+        assert opened.chunk_range(0, 2) is None and opened.chunks(1) == []
+        assert opened.nbytes == (tmp_path / "documents.bin").stat().st_size
+    
+    def test_concurrent_writers(self, tmp_path):
+        from src.rag.store import DocumentStore
+        DocumentStore(["base"]).save(tmp_path)
+        first, second = DocumentStore.open(tmp_path), DocumentStore.open(tmp_path)
+        first.add("primeiro worker", [(0, 8)])
+        second.add("segundo worker", [(0, 7)])  # grava após o fim real do blob
+        
+        assert first.refresh() == 2 and second.refresh() == 3
+        expected = ["base", "primeiro worker", "segundo worker"]
+        assert list(first) == list(second) == list(DocumentStore.open(tmp_path)) == expected
+        assert first.chunks(2) == ["segundo"]
+        
+        DocumentStore(["novo corpus"]).save(tmp_path)
+        assert first.refresh() == 0 and list(first) == ["novo corpus"]
+
+
+class TestLexical:
+    def test_analyzer(self):
+        from src.rag.lexical import Analyzer
+        analyze = Analyzer()
+        assert analyze("Férias") == analyze("ferias")
+        assert analyze("política") == analyze("Políticas")
+        assert analyze("Erro CLI-2024-0892 no home-office") == ["erro", "cli-2024-0892", "home", "office"]
+        assert Analyzer(fold=False, stopwords=False, stemming=False)("As férias") == ["as", "férias"]
+    
+    def test_term_ids(self):
+        from src.rag.lexical import BM25Index, tokenize
+        index = BM25Index()
+        index.add("a", tokenize("Política de férias: 30 dias"))
+        index.add("b", tokenize("Políticas de home office"))
+        assert len(index.terms) == 6  # politica feria 30 dia home office
+        assert index.postings[index.terms.get("politica")][0].tolist() == [0, 1]
+        assert index.document_frequencies()["politica"] == 2
+        assert [doc for doc, _ in index.search(tokenize("ferias"), k=5)] == ["a"]
+        assert index.search(tokenize("inexistente"), k=5) == []
+
+
+class TestDedup:
+    POLICY = ("Política de férias: todo colaborador tem direito a 30 dias de férias por ano, "
+              "que podem ser divididos em até três períodos, desde que um deles tenha pelo menos "
+              "quatorze dias corridos. O pedido deve ser feito com 30 dias de antecedência.")
+    
+    def test_near_duplicate(self):
+        from src.rag.dedup import NearDuplicateIndex
+        index = NearDuplicateIndex(threshold=0.7)
+        assert index.add("a", self.POLICY) is None
+        assert index.add("b", self.POLICY.replace("Política", "POLITICA")) == "a"
+        assert index.add("c", self.POLICY.replace("antecedência", "antecedência mínima")) == "a"
+        assert index.add("d", "Home office: até três dias por semana com aprovação do gestor.") is None
+        assert len(index) == 2
+    
+    def test_pipeline_collapses_chunks(self):
+        from src.rag.lexical import BM25Index
+        from src.rag.pipeline import RAGPipeline
+        
+        class Store:
+            def __init__(self):
+                self.added = []
+            
+            def add_documents(self, docs):
+                self.added.extend(docs)
+        
+        pipeline = RAGPipeline()
+        pipeline.vector_store = Store()
+        pipeline.bm25 = BM25Index()
+        other = "Home office: até três dias por semana com aprovação do gestor."
+        report = pipeline.add_documents(
+            [self.POLICY, other, self.POLICY.replace("30 dias de antecedência", "30 dias antecedência")],
+            append=True, commit=False
+        )
+        
+        assert report.chunks == 3 and report.embeddings_saved == 1 and report.duplicate_documents == 1
+        assert len(pipeline.vector_store.added) == 2
+        assert pipeline.duplicates == {"doc_0:0": ["doc_2"], "doc_0": ["doc_2"]}
+        
+        results = pipeline.bm25_search("férias antecedência")
+        assert [r.source for r in results] == ["doc_0"]
+        assert results[0].metadata["sources"] == ["doc_0", "doc_2"]
+    
+    def test_failed_embedding_is_rolled_back(self):
+        from src.rag.lexical import BM25Index
+        from src.rag.pipeline import RAGPipeline
+        
+        class FlakyStore:
+            def __init__(self):
+                self.added = []
+                self.failures = 1
+            
+            def add_documents(self, docs):
+                if self.failures:
+                    self.failures -= 1
+                    raise RuntimeError("embeddings indisponíveis")
+                self.added.extend(docs)
+        
+        pipeline = RAGPipeline()
+        pipeline.vector_store = FlakyStore()
+        pipeline.bm25 = BM25Index()
+        batch = [self.POLICY, self.POLICY.upper()]
+        with pytest.raises(RuntimeError):
+            pipeline.add_documents(batch, append=True, commit=False)
+        assert pipeline.duplicates == {} and len(pipeline.documents) == 0
+        
+        report = pipeline.add_documents(batch, append=True, commit=False)
+        assert report.duplicate_chunks == 1 and len(pipeline.vector_store.added) == 1
+        assert pipeline.duplicates == {"doc_0:0": ["doc_1"], "doc_0": ["doc_1"]}
+    
+    def test_workers_share_corpus(self, tmp_path, monkeypatch):
+        from src.config import settings
+        from src.rag.pipeline import RAGPipeline
+        from src.rag.store import DocumentStore
+        monkeypatch.setattr(settings, "index_dir", str(tmp_path))
+        
+        class Store:
+            def add_documents(self, docs):
+                pass
+        
+        workers = []
+        DocumentStore(["Política de férias"]).save(tmp_path)
+        for _ in range(2):
+            pipeline = RAGPipeline()
+            pipeline.load_index(vector_store=False)
+            pipeline.vector_store = Store()
+            workers.append(pipeline)
+        
+        workers[0].add_documents(["Home office três dias"], append=True)
+        workers[1].add_documents([self.POLICY, "Reembolso de despesas"], append=True)
+        workers[0].add_documents([self.POLICY.upper()], append=True)  # duplicata de doc_2, gravado pelo outro
+        
+        assert list(workers[0].documents) == list(DocumentStore.open(tmp_path))
+        assert workers[0].duplicates == {"doc_2:0": ["doc_4"], "doc_2": ["doc_4"]}
+        assert [r.source for r in workers[1].bm25_search("home office")] == ["doc_1"]
+        assert len(workers[1].documents) == 4  # doc_4 ainda não sincronizado
+        results = workers[1].retrieve("antecedência", strategy="bm25")
+        assert len(workers[1].documents) == 5 and workers[1].duplicates == workers[0].duplicates
+        assert results[0].source == "doc_2" and results[0].metadata["sources"] == ["doc_2", "doc_4"]
+
+
+def _offline_pipeline(documents, responses):
+    """RAGPipeline com BM25 local e LLM falso."""
+    from langchain_core.language_models import FakeListChatModel
+    from src.rag.lexical import BM25Index
+    from src.rag.pipeline import RAGPipeline
+    from src.rag.store import DocumentStore
+    
+    pipeline = RAGPipeline()
+    pipeline.documents = DocumentStore(documents)
+    pipeline.bm25 = pipeline._index_lexical(BM25Index(), documents)
+    pipeline._llm = FakeListChatModel(responses=responses)
+    return pipeline
+
+
+class TestRefinement:
+    BAD = '{"support": "no", "utility": 2, "issues": ["home office 3 dias"]}'
+    GOOD = '{"support": "fully", "utility": 5, "issues": []}'
+    
+    def test_refines_with_new_context(self):
+        pipeline = _offline_pipeline(
+            ["Política de férias: 30 dias.", "Home office: 3 dias por semana.", "Outro assunto."],
+            ["r1", self.BAD, "r2", self.GOOD]
+        )
+        result = pipeline.process("política de férias", k=1, strategy="bm25")
+        assert result.answer == "r2"
+        assert result.was_refined
+        assert result.confidence == 1.0
+        assert pipeline.llm.i == 0  # as 4 respostas foram consumidas
+    
+    def test_stops_when_context_unchanged(self):
+        pipeline = _offline_pipeline(["Política de férias: 30 dias."], ["r1", self.BAD, "nunca"])
+        result = pipeline.process("política de férias", strategy="bm25")
+        assert result.answer == "r1"
+        assert not result.was_refined
+        assert pipeline.llm.i == 2
+    
+    def test_streams_first_answer(self):
+        pipeline = _offline_pipeline(["Política de férias: 30 dias."], ["resposta", self.GOOD])
+        tokens = []
+        result = pipeline.process("política de férias", strategy="bm25", on_token=tokens.append)
+        assert "".join(tokens) == result.answer == "resposta"
+        assert len(tokens) > 1
+    
+    def test_orchestrator_refiner(self):
+        from src.agents.orchestrator import Orchestrator
+        pipeline = _offline_pipeline(["Política de férias: 30 dias."], ["r1", self.BAD, "nunca"])
+        result = Orchestrator(pipeline).process("política de férias", strategy="bm25")
+        assert result.answer == "r1"
+        assert not result.was_refined
+        assert pipeline.llm.i == 2
+
+
+class TestTrace:
+    BAD = TestRefinement.BAD
+    GOOD = TestRefinement.GOOD
+
+    def test_pipeline_stages_and_slow_log(self, caplog, monkeypatch):
+        import json
+        import logging
+        from src.config import settings
+        from src.observability.trace import request_trace
+
+        monkeypatch.setattr(settings, "slow_query_ms", 0.0)
+        pipeline = _offline_pipeline(
+            ["Política de férias: 30 dias.", "Home office: 3 dias por semana.", "Outro assunto."],
+            ["r1", self.BAD, "r2", self.GOOD]
+        )
+        with caplog.at_level(logging.WARNING, logger="rag.slow_queries"):
+            with request_trace("query") as trace:
+                pipeline.process("política de férias", k=1, strategy="bm25")
+
+        stages = [s["stage"] for s in trace.stages]
+        for name in ("route", "retrieve", "bm25", "generate", "evaluate", "refine"):
+            assert name in stages
+        retrieve = next(s for s in trace.stages if s["stage"] == "retrieve")
+        assert retrieve["candidates"] == 1 and retrieve["ms"] >= 0
+        assert trace.counters["retrieval_cache_miss"] == 2
+        assert trace.attributes["was_refined"] is True
+        assert "retrieve;dur=" in trace.server_timing()
+
+        logged = json.loads(caplog.records[-1].getMessage())
+        assert logged["request_id"] == trace.request_id
+        assert logged["question"] == "política de férias"
+
+    def test_debug_header(self, monkeypatch):
+        from fastapi.testclient import TestClient
+        from src.api.main import app, get_pipeline
+        from src.config import settings
+
+        pipeline = _offline_pipeline(["Política de férias: 30 dias."], ["r1", self.GOOD, "r2", self.GOOD])
+        app.dependency_overrides[get_pipeline] = lambda: pipeline
+        try:
+            client = TestClient(app)
+            plain = client.post("/query", json={"question": "férias", "strategy": "bm25"})
+            assert plain.status_code == 200 and "debug" not in plain.json()
+            assert "server-timing" not in plain.headers
+            ignored = client.post("/query", json={"question": "férias", "strategy": "bm25"}, headers={"X-Debug": "1"})
+            assert "debug" not in ignored.json()  # desligado por padrão
+
+            monkeypatch.setattr(settings, "debug_header_enabled", True)
+            response = client.post(
+                "/query",
+                json={"question": "dias de férias", "strategy": "bm25"},
+                headers={"X-Debug": "profile"}
+            )
+            debug = response.json()["debug"]
+            assert debug["request_id"] == response.headers["x-request-id"]
+            assert "generate" in [s["stage"] for s in debug["stages"]]
+            assert "cumulative" in debug["profile"]
+            assert "total;dur=" in response.headers["server-timing"]
+        finally:
+            app.dependency_overrides.clear()
+
+    def test_orchestrator_nodes(self):
+        from src.agents.orchestrator import Orchestrator
+        from src.observability.trace import request_trace
+
+        pipeline = _offline_pipeline(["Política de férias: 30 dias."], ["r1", self.GOOD])
+        with request_trace("orchestrator") as trace:
+            Orchestrator(pipeline).process("política de férias", strategy="bm25")
+        stages = [s["stage"] for s in trace.stages]
+        assert {"node:retrieve", "node:generate", "node:validate", "bm25"} <= set(stages)
+
+
+class FakePipeline:
+    """Pipeline sem LLM para testar o orquestrador."""
+    
+    def __init__(self):
+        from src.rag.router import AnswerCache, QueryRouter
+        self.calls = []
+        self.answer_cache = AnswerCache()
+        self.router = QueryRouter(self.answer_cache)
+    
+    def retrieve(self, query, k=None, strategy="hybrid"):
+        from src.models import SearchResult
+        self.calls.append(strategy)
+        return [SearchResult(content=f"ctx {query}", score=1.0, source="doc_0",
+                             metadata={"sources": ["doc_0", "doc_3"]})]
+    
+    def generate(self, query, context):
+        self.calls.append("generate")
+        return f"resposta {query}"
+    
+    async def agenerate(self, query, context):
+        self.calls.append("agenerate")
+        return f"resposta {query}"
+    
+    def evaluate(self, answer, context):
+        from src.models import EvaluationResult
+        self.calls.append("evaluate")
+        return EvaluationResult(support_level="fully", utility_score=3)
+    
+    async def aevaluate(self, answer, context):
+        return self.evaluate(answer, context)
 
 
 class TestOrchestrator:
@@ -46,6 +371,73 @@ class TestOrchestrator:
         from src.agents.orchestrator import Orchestrator
         orch = Orchestrator()
         assert orch is not None
+    
+    def test_shared_graph(self):
+        from src.agents.orchestrator import Orchestrator
+        a, b = Orchestrator(FakePipeline()), Orchestrator(FakePipeline())
+        assert a.graph is b.graph
+    
+    def test_process_with_existing_pipeline(self):
+        from src.agents.orchestrator import Orchestrator
+        pipeline = FakePipeline()
+        result = Orchestrator(pipeline).process("férias")
+        assert result.answer == "resposta férias"
+        assert result.confidence == 0.6
+        assert result.sources == ["doc_0", "doc_3"]  # quase-duplicatas preservadas
+        assert pipeline.calls == ["hybrid", "generate", "evaluate"]
+    
+    def test_exact_match_skips_validation(self):
+        from src.agents.orchestrator import Orchestrator
+        pipeline = FakePipeline()
+        orch = Orchestrator(pipeline)
+        result = orch.process("NF-404")
+        assert result.strategy_used == "bm25"
+        assert result.confidence == 1.0
+        assert pipeline.calls == ["bm25", "generate"]
+        
+        assert orch.process("nf-404?").strategy_used == "cache"
+        assert pipeline.calls == ["bm25", "generate"]
+    
+    def test_abatch(self):
+        import asyncio
+        from src.agents.orchestrator import Orchestrator
+        pipeline = FakePipeline()
+        results = asyncio.run(Orchestrator(pipeline).abatch(["a", "b", "c"], max_concurrency=2))
+        assert [r.answer for r in results] == ["resposta a", "resposta b", "resposta c"]
+        assert pipeline.calls.count("agenerate") == 3
+
+
+class TestRouter:
+    def test_routes(self):
+        from src.rag.router import QueryRouter
+        router = QueryRouter()
+        assert router.route("Status do CLI-2024-0892").strategy == "bm25"
+        assert router.route("NF-404").identifiers == ["NF-404"]
+        assert router.route("Como funciona o home office?").strategy == "semantic"
+        assert router.route("política de férias").strategy == "hybrid"
+        assert router.route("NF-404", strategy="semantic").strategy == "semantic"
+    
+    def test_invalid_strategy(self):
+        from src.rag.router import QueryRouter
+        with pytest.raises(ValueError):
+            QueryRouter().route("x", strategy="magic")
+    
+    def test_cache_route(self):
+        from src.models import QueryResponse
+        from src.rag.router import QueryRouter
+        router = QueryRouter()
+        router.cache.put("Qual a política de férias?", QueryResponse(answer="30 dias"))
+        assert router.route("qual a política de férias").strategy == "cache"
+    
+    def test_exact_match_whole_identifier(self):
+        from src.models import SearchResult
+        from src.rag.router import QueryRouter
+        router = QueryRouter()
+        top = [SearchResult(content="Erro NF-404 e cliente CLI-2024-0892.", score=1.0)]
+        assert router.is_exact_match(router.route("nf-404"), top)
+        assert router.is_exact_match(router.route("CLI-2024-0892 e NF-404"), top)
+        assert not router.is_exact_match(router.route("NF-40"), top)
+        assert not router.is_exact_match(router.route("CLI-2024-08"), top)
 
 
 class TestMetrics:
@@ -53,12 +445,337 @@ class TestMetrics:
         from src.observability.metrics import MetricsCollector
         m = MetricsCollector()
         assert m is not None
+    
+    def test_concurrent_first_use(self):
+        import subprocess
+        code = (
+            "from concurrent.futures import ThreadPoolExecutor\n"
+            "from src.observability.metrics import get_metrics\n"
+            "with ThreadPoolExecutor(8) as pool:\n"
+            "    collectors = list(pool.map(lambda _: get_metrics(), range(8)))\n"
+            "print(len({id(c) for c in collectors}))"
+        )
+        proc = subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).parent.parent,
+                              capture_output=True, text=True)
+        assert proc.returncode == 0, proc.stderr
+        assert proc.stdout.strip() == "1"
+
+
+class TestStartup:
+    HEAVY = ["langchain", "langchain_openai", "langchain_chroma", "chromadb",
+             "onnxruntime", "rank_bm25", "langgraph", "prometheus_client"]
+    IMPORT_BUDGET_S = 1.5
+    
+    def _importtime(self, code: str):
+        import subprocess
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=Path(__file__).parent.parent, capture_output=True, text=True, check=True
+        )
+        cumulative = {}
+        for line in proc.stderr.splitlines():
+            parts = [p.strip() for p in line.split("|")]
+            if len(parts) == 3 and parts[1].isdigit():
+                cumulative[parts[2]] = int(parts[1]) / 1e6
+        return proc.stdout, cumulative
+    
+    def test_no_heavy_imports(self):
+        stdout, _ = self._importtime(
+            "import sys, src.api, src.agents, src.observability; "
+            f"print(','.join(m for m in {self.HEAVY!r} if m in sys.modules))"
+        )
+        assert stdout.strip() == ""
+    
+    def test_import_budget(self):
+        _, cumulative = self._importtime("import src.api, src.agents")
+        assert cumulative["src.api"] < self.IMPORT_BUDGET_S
+    
+    def test_lazy_clients(self):
+        from src.rag.pipeline import RAGPipeline
+        pipeline = RAGPipeline()
+        assert pipeline._llm is None and pipeline._embeddings is None
 
 
 class TestAPI:
     def test_app_exists(self):
         from src.api.main import app
         assert app is not None
+    
+    def test_ready(self):
+        from types import SimpleNamespace
+        from fastapi.testclient import TestClient
+        from src.api.main import app, get_pipeline
+        
+        pipeline = SimpleNamespace(is_ready=False, documents=["doc"])
+        app.dependency_overrides[get_pipeline] = lambda: pipeline
+        try:
+            client = TestClient(app)
+            assert client.get("/ready").status_code == 503
+            pipeline.is_ready = True
+            assert client.get("/ready").json()["status"] == "ready"
+        finally:
+            app.dependency_overrides.clear()
+    
+    def test_invalid_strategy(self):
+        from fastapi.testclient import TestClient
+        from src.api.main import app, get_pipeline
+        
+        app.dependency_overrides[get_pipeline] = lambda: _offline_pipeline(["Home office"], [])
+        try:
+            response = TestClient(app).post("/query", json={"question": "home office", "strategy": "fuzzy"})
+            assert response.status_code == 422
+        finally:
+            app.dependency_overrides.clear()
+    
+    def test_worker_crash_loop(self, tmp_path):
+        import os
+        import subprocess
+        code = (
+            "import logging, sys\n"
+            "from src.api import server\n"
+            "server.WORKER_MIN_UPTIME, server.RESPAWN_BACKOFF, server.MAX_STARTUP_CRASHES = 60, 0.01, 3\n"
+            "def boom(sock):\n"
+            "    raise RuntimeError('sem OPENAI_API_KEY')\n"
+            "server._run_worker = boom\n"
+            "logging.basicConfig()\n"
+            "sys.exit(server.serve(workers=1, host='127.0.0.1', port=0))"
+        )
+        proc = subprocess.run(
+            [sys.executable, "-c", code], cwd=Path(__file__).parent.parent, capture_output=True, text=True,
+            env={**os.environ, "INDEX_DIR": str(tmp_path)}, timeout=30
+        )
+        assert proc.returncode == 1
+        assert proc.stderr.count("RuntimeError: sem OPENAI_API_KEY") == 3  # traceback de cada worker
+
+
+class IngestPipeline:
+    """Pipeline falso que registra os lotes da ingestão."""
+    
+    def __init__(self, fail_on: str = None):
+        self.documents = []
+        self.batches = []
+        self.commits = 0
+        self.fail_on = fail_on
+    
+    def add_documents(self, documents, append=False, commit=True):
+        assert append and not commit
+        if self.fail_on in documents:
+            raise RuntimeError("embedding falhou")
+        self.batches.append(list(documents))
+        self.documents.extend(documents)
+    
+    def commit_index(self):
+        self.commits += 1
+
+
+class TestBulkIngest:
+    def _run(self, tmp_path, monkeypatch, pipeline, **post):
+        import tempfile
+        import time
+        from fastapi.testclient import TestClient
+        from src.api import main
+        from src.api.ingest import IngestManager
+        
+        monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+        monkeypatch.setattr(main, "ingest_jobs", IngestManager(batch_size=2, status_dir=str(tmp_path)))
+        main.app.dependency_overrides[main.get_pipeline] = lambda: pipeline
+        try:
+            client = TestClient(main.app)
+            response = client.post("/documents/bulk", **post)
+            assert response.status_code == 202, response.text
+            job_id = response.json()["job_id"]
+            for _ in range(200):
+                status = client.get(f"/documents/jobs/{job_id}").json()
+                if status["state"] in ("done", "failed"):
+                    return status
+                time.sleep(0.01)
+            raise AssertionError("job não terminou")
+        finally:
+            main.app.dependency_overrides.clear()
+    
+    def test_ndjson(self, tmp_path, monkeypatch):
+        pipeline = IngestPipeline()
+        body = '"doc 1"\n{"content": "doc 2"}\n\n{"text": "doc 3"}\nnão é json\n{"id": 5}\n'
+        status = self._run(tmp_path, monkeypatch, pipeline, content=body.encode(),
+                           headers={"Content-Type": "application/x-ndjson"})
+        
+        assert status["state"] == "done"
+        assert pipeline.batches == [["doc 1", "doc 2"], ["doc 3"]]
+        assert pipeline.commits == 1
+        assert status["documents"] == 3 and status["batches"] == 2
+        assert status["errors"] == 2 and len(status["error_samples"]) == 2
+        assert status["progress"] == 1.0
+        assert not list(tmp_path.glob("rag-ingest-*"))
+    
+    def test_multipart_and_failed_batch(self, tmp_path, monkeypatch):
+        pipeline = IngestPipeline(fail_on="ruim")
+        files = [
+            ("files", ("a.txt", b"Politica de ferias", "text/plain")),
+            ("files", ("b.jsonl", b'"ruim"\n"x"\n"ok"\n', "application/octet-stream"))
+        ]
+        status = self._run(tmp_path, monkeypatch, pipeline, files=files)
+        
+        assert status["state"] == "done"
+        # O lote ["Politica de ferias", "ruim"] falha inteiro
+        assert pipeline.documents == ["x", "ok"]
+        assert status["documents"] == 2 and status["errors"] == 2
+    
+    def test_document_size_limit(self, tmp_path, monkeypatch):
+        from src.api.ingest import IngestManager
+        from src.config import settings
+        from src.models import IngestStatus
+        
+        monkeypatch.setattr(settings, "ingest_max_document_bytes", 16)
+        files = {"big.txt": b"x" * 100, "small.txt": b"curto", "docs.ndjson": b'"ok"\n"' + b"y" * 50 + b'"\n"fim"'}
+        for name, data in files.items():
+            (tmp_path / name).write_bytes(data)
+        sources = [(str(tmp_path / "big.txt"), "text"), (str(tmp_path / "small.txt"), "text"),
+                   (str(tmp_path / "docs.ndjson"), "ndjson")]
+        
+        status = IngestStatus(job_id="x")
+        manager = IngestManager(status_dir=str(tmp_path / "jobs"))
+        assert list(manager._documents(status, sources)) == ["curto", "ok", "fim"]
+        assert status.errors == 2
+        assert status.bytes_read == sum(len(d) for d in files.values())
+    
+    def test_status_from_other_worker(self, tmp_path):
+        from src.api.ingest import IngestManager
+        from src.models import IngestStatus
+        
+        IngestManager(status_dir=str(tmp_path))._save(IngestStatus(job_id="abc123", state="done", documents=7))
+        assert IngestManager(status_dir=str(tmp_path)).get("abc123").documents == 7
+        assert IngestManager(status_dir=str(tmp_path)).get("../x") is None
+    
+    def test_unsupported_type(self):
+        from fastapi.testclient import TestClient
+        from src.api.main import app
+        assert TestClient(app).post("/documents/bulk", json=["doc"]).status_code == 415
+
+
+class TestAdmission:
+    def test_token_bucket(self):
+        from src.api.admission import TokenBucket
+        now = [0.0]
+        bucket = TokenBucket(rate=1.0, capacity=2, clock=lambda: now[0])
+        assert bucket.try_acquire()[0]
+        assert bucket.try_acquire()[0]
+        ok, retry_after = bucket.try_acquire()
+        assert not ok and retry_after == pytest.approx(1.0)
+        now[0] = 1.0
+        assert bucket.try_acquire()[0]
+    
+    def test_queue_priority_and_shedding(self):
+        import asyncio
+        from src.api.admission import AdmissionController, Overloaded
+        
+        async def scenario():
+            ctl = AdmissionController(initial_limit=1, min_limit=1, queue_size=2, max_wait=1.0)
+            await ctl.acquire()
+            order = []
+            
+            async def wait(priority):
+                await ctl.acquire(priority)
+                order.append(priority)
+            
+            tasks = [asyncio.create_task(wait("low")), asyncio.create_task(wait("high"))]
+            await asyncio.sleep(0)
+            with pytest.raises(Overloaded) as exc:
+                await ctl.acquire()
+            assert exc.value.status_code == 503 and "Retry-After" in exc.value.headers
+            
+            ctl.release(0.1)
+            await asyncio.sleep(0)
+            ctl.release(0.1)
+            await asyncio.gather(*tasks)
+            return order
+        
+        assert asyncio.run(scenario()) == ["high", "low"]
+    
+    def test_queue_timeout(self):
+        import asyncio
+        from src.api.admission import AdmissionController, Overloaded
+        
+        async def scenario():
+            ctl = AdmissionController(initial_limit=1, min_limit=1, max_wait=0.01)
+            await ctl.acquire()
+            with pytest.raises(Overloaded):
+                await ctl.acquire()
+            assert ctl.get_stats()["queued"] == 0
+        
+        asyncio.run(scenario())
+    
+    def test_adaptive_limit(self):
+        from src.api.admission import AdmissionController
+        ctl = AdmissionController(initial_limit=10, min_limit=2, max_limit=20, sample=5)
+        
+        def sample(latency):
+            for _ in range(5):
+                ctl.in_flight += 1
+                ctl.release(latency)
+        
+        sample(0.1)
+        sample(0.1)
+        assert ctl.limit > 10
+        limit = ctl.limit
+        ctl.in_flight += 1
+        ctl.release(1.0)  # uma requisição lenta sozinha não decide
+        assert ctl.limit == limit
+        sample(1.0)
+        assert ctl.limit < limit
+        ctl.in_flight += 1
+        ctl.release(0.1, error=True)
+        assert ctl.limit < limit * 0.9
+    
+    def test_lognormal_latency_grows_limit(self):
+        import math
+        import random
+        from src.api.admission import AdmissionController
+        rng = random.Random(0)
+        ctl = AdmissionController(initial_limit=8, min_limit=2, max_limit=64)
+        for _ in range(3000):
+            ctl.in_flight += 1
+            ctl.release(rng.lognormvariate(math.log(2.0), 0.5))  # mediana 2s, sem sobrecarga
+        assert ctl.limit > 40
+        
+        steady = ctl.limit
+        for _ in range(100):
+            ctl.in_flight += 1
+            ctl.release(rng.lognormvariate(math.log(6.0), 0.5))  # sobrecarga: 3x mais lento
+        assert ctl.limit < steady * 0.75
+    
+    def test_fast_outlier_does_not_pin_limit(self):
+        import random
+        from src.api.admission import AdmissionController
+        rng = random.Random(0)
+        ctl = AdmissionController(initial_limit=8, min_limit=2, max_limit=64)
+        ctl.in_flight += 2
+        ctl.release(0.002, upstream=False)  # cache hit
+        ctl.release(0.002)  # outlier rápido que chegou ao upstream
+        for _ in range(500):
+            ctl.in_flight += 1
+            ctl.release(rng.uniform(1.5, 3.0))
+        assert ctl.limit > 20
+    
+    def test_rate_limit_429(self, monkeypatch):
+        from fastapi.testclient import TestClient
+        from src.api import main
+        from src.api.admission import RateLimiter
+        from src.models import QueryResponse
+        
+        class Stub:
+            def process(self, question, k=None, strategy="auto"):
+                return QueryResponse(answer="ok")
+        
+        monkeypatch.setattr(main, "rate_limiter", RateLimiter(per_minute=60, burst=1))
+        main.app.dependency_overrides[main.get_pipeline] = Stub
+        try:
+            client = TestClient(main.app)
+            assert client.post("/query", json={"question": "a"}).status_code == 200
+            response = client.post("/query", json={"question": "a"})
+            assert response.status_code == 429
+            assert response.headers["Retry-After"] == "1"
+        finally:
+            main.app.dependency_overrides.clear()
 
 
 if __name__ == "__main__":